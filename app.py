@@ -1,5 +1,6 @@
 """Flask app entry. Local deployment only; serves React build and API."""
 import os
+import threading
 from pathlib import Path
 
 from flask import Flask, render_template, current_app
@@ -7,7 +8,8 @@ from flask import Flask, render_template, current_app
 import config
 from backend.models import db
 from backend.routes.api import api_bp
-from backend.services.rag import sync_memories_from_db
+from backend.services.models_config import prewarm_provider_models
+from backend.services.rag import preload as preload_rag, sync_memories_from_db
 
 config.ensure_data_dirs()
 
@@ -57,6 +59,10 @@ with app.app_context():
         pass
     sync_memories_from_db(app)
 
+# Provider model lists and the embedding model are loaded in the background while the server comes up.
+prewarm_provider_models()
+threading.Thread(target=preload_rag, name="rag-preload", daemon=True).start()
+
 
 @app.route("/")
 def index_chat():
@@ -36,11 +36,12 @@ def _parse_data_url(url: str):
     """Parse data URL (data:image/png;base64,...) -> (media_type, base64_data). Returns (None, None) on failure."""
     if not url or not url.startswith("data:"):
         return None, None
-    rest = url[5:].strip()
-    if ";base64," in rest:
-        media_type, b64 = rest.split(";base64,", 1)
-        return media_type.strip().lower() or "image/png", b64
-    return None, None
+    # The marker sits in the short header: bound the search and slice the payload once
+    # instead of copying the whole (multi-MB) URL via strip() and split().
+    i = url.find(";base64,", 5, 5 + 256)
+    if i == -1:
+        return None, None
+    return url[5:i].strip().lower() or "image/png", url[i + 8:].rstrip()
 
 
 def _to_anthropic_content(m):
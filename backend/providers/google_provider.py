@@ -1,6 +1,6 @@
 """Google (Gemini) thin wrapper. generate(messages, model, stream=True) -> yield chunks.
 Uses the google.genai package (not the deprecated google.generativeai)."""
-import base64
+import binascii
 from google import genai
 from google.genai import types
 
@@ -47,11 +47,12 @@ def _build_contents(messages):
                         parts.append(types.Part.from_text(text=part.get("text", "")))
                     elif part.get("type") == "image_url":
                         url = (part.get("image_url") or {}).get("url") or ""
-                        if url.startswith("data:") and ";base64," in url:
+                        i = url.find(";base64,", 5, 5 + 256) if url.startswith("data:") else -1
+                        if i != -1:
                             try:
-                                header, b64 = url.split(";base64,", 1)
-                                mime = header[5:].strip().lower() or "image/png"
-                                data = base64.standard_b64decode(b64)
+                                mime = url[5:i].strip().lower() or "image/png"
+                                # a2b_base64 reads an ASCII str in place; b64decode would encode a copy first.
+                                data = binascii.a2b_base64(url[i + 8:])
                                 parts.append(types.Part.from_bytes(data=data, mime_type=mime))
                             except Exception:
                                 pass
@@ -1,13 +1,27 @@
 """API blueprint: chats, models, streaming, contexts, memory."""
+import atexit
 import base64
+import io
+import logging
 import re
-import json
+import socket
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
+import orjson
 import yaml
-from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
+from flask import Blueprint, request, jsonify, Response, send_file, stream_with_context, current_app
+from sqlalchemy import text
+from sqlalchemy.orm import selectinload
+
+try:
+    from yaml import CSafeDumper as _YamlDumper
+except ImportError:  # PyYAML built without LibYAML
+    from yaml import SafeDumper as _YamlDumper
 
 import config
 from backend.models import db, Chat, Message, Memory
@@ -19,8 +33,12 @@ from backend.services.prompt_builder import (
     build_system_message,
     get_command_body_if_invoked,
     list_contexts,
+    invalidate_context,
     load_rules,
     load_commands,
+    get_command_by_id,
+    invalidate_rules,
+    invalidate_commands,
     resolve_active_rules,
 )
 from backend.services.prompt_builder import _context_name_from_first_line
@@ -50,6 +68,17 @@ from backend.services.web_search_mode import (
 )
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
+logger = logging.getLogger(__name__)
+
+# Memory extraction runs on a small shared pool instead of a new thread per reply.
+_MEMORY_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mem")
+# Caps running + queued extractions; turns beyond that are dropped rather than queued without bound.
+_MEMORY_SLOTS = threading.BoundedSemaphore(16)
+# Chat titles are generated alongside the reply stream rather than after it.
+_TITLE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="title")
+# Don't hold up interpreter exit on queued background work.
+atexit.register(_MEMORY_POOL.shutdown, wait=False, cancel_futures=True)
+atexit.register(_TITLE_POOL.shutdown, wait=False, cancel_futures=True)
 
 
 @api_bp.route("/models", methods=["GET"])
@@ -94,11 +123,15 @@ def put_settings():
     return jsonify(settings)
 
 
+# \Z rather than $ so a trailing newline is not accepted as part of an id.
+_ID_RE = re.compile(r"\A[a-zA-Z0-9_-]+\Z")
+
+
 def _safe_context_id(id_str):
     """Allow only alphanumeric, hyphen, underscore."""
     if not id_str or not isinstance(id_str, str):
         return None
-    if not re.match(r"^[a-zA-Z0-9_-]+$", id_str):
+    if not _ID_RE.match(id_str):
         return None
     return id_str
 
@@ -107,11 +140,20 @@ def _safe_rule_or_command_id(id_str):
     """Allow only alphanumeric, hyphen, underscore for rule/command ids."""
     if not id_str or not isinstance(id_str, str):
         return None
-    if not re.match(r"^[a-zA-Z0-9_-]+$", id_str):
+    if not _ID_RE.match(id_str):
         return None
     return id_str
 
 
+def _frontmatter_text(meta, body):
+    """Render a rule/command file: YAML frontmatter followed by the markdown body."""
+    out = io.StringIO()
+    out.write("---\n")
+    yaml.dump(meta, out, Dumper=_YamlDumper, sort_keys=False, default_flow_style=False)
+    out.write(f"---\n\n{body}\n")
+    return out.getvalue()
+
+
 def _mode_from_payload(data, *, default_mode=WEB_SEARCH_MODE_OFF):
     """
     Read web search mode from payload, with legacy boolean compatibility.
@@ -154,7 +196,8 @@ def get_context(id):
     path = config.CONTEXTS_DIR / f"{safe}.md"
     if not path.exists():
         return jsonify({"error": "not found"}), 404
-    return Response(path.read_text(encoding="utf-8"), mimetype="text/markdown")
+    # send_file streams from disk (sendfile where the server supports it) and answers 304 to revalidations.
+    return send_file(path, mimetype="text/markdown", conditional=True)
 
 
 @api_bp.route("/contexts/<id>", methods=["PUT"])
@@ -165,6 +208,7 @@ def put_context(id):
     path = config.CONTEXTS_DIR / f"{safe}.md"
     body = request.get_data(as_text=True) or ""
     path.write_text(body, encoding="utf-8")
+    invalidate_context(safe)
     name = _context_name_from_first_line(body) if body else safe
     return jsonify({"id": safe, "name": name})
 
@@ -178,25 +222,38 @@ def delete_context(id):
     if not path.exists():
         return jsonify({"error": "not found"}), 404
     path.unlink()
+    invalidate_context(safe)
     return "", 204
 
 
 # ----- Rules (file-backed) -----
+# kind -> (loaded dict, sorted listing); the loaders return a new dict whenever files change.
+_LISTING_CACHE = {}
+
+
+def _cached_listing(kind, items, build):
+    """Return the name-sorted listing for items, rebuilding it only when the loader reloaded."""
+    hit = _LISTING_CACHE.get(kind)
+    if hit is not None and hit[0] is items:
+        return hit[1]
+    # Sort by name for stable UI.
+    out = sorted((build(x) for x in items.values()), key=lambda x: x["name"].lower())
+    _LISTING_CACHE[kind] = (items, out)
+    return out
+
+
 @api_bp.route("/rules", methods=["GET"])
 def list_rules_route():
-    rules = load_rules()
-    out = []
-    for r in rules.values():
-        out.append(
-            {
-                "id": r.id,
-                "name": r.name,
-                "always_on": r.always_on,
-                "tags": r.tags,
-            }
-        )
-    # Sort by name for stable UI.
-    out.sort(key=lambda x: x["name"].lower())
+    out = _cached_listing(
+        "rules",
+        load_rules(),
+        lambda r: {
+            "id": r.id,
+            "name": r.name,
+            "always_on": r.always_on,
+            "tags": r.tags,
+        },
+    )
     return jsonify(out)
 
 
@@ -238,12 +295,11 @@ def put_rule(id):
         "always_on": always_on,
         "tags": tags,
     }
-    text = f"---\n{yaml.safe_dump(meta, sort_keys=False).strip()}\n---\n\n{body}\n"
+    text = _frontmatter_text(meta, body)
     path = config.RULES_DIR / f"{safe}.md"
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(text, encoding="utf-8")
-    # Refresh cache by reloading.
-    _ = load_rules()
+    invalidate_rules()
     return jsonify(
         {
             "id": safe,
@@ -263,38 +319,36 @@ def delete_rule(id):
     if not path.exists():
         return jsonify({"error": "not found"}), 404
     path.unlink()
+    invalidate_rules()
     return "", 204
 
 
 # ----- Commands (file-backed) -----
 @api_bp.route("/commands", methods=["GET"])
 def list_commands_route():
-    cmds = load_commands()
-    out = []
-    for c in cmds.values():
-        web_search_mode = command_web_search_mode_for_api(c)
-        out.append(
-            {
-                "id": c.id,
-                "name": c.name,
-                "description": c.description,
-                "tags": c.tags,
-                "web_search_enabled": is_web_search_enabled(web_search_mode),
-                "web_search_mode": web_search_mode,
-                "web_search_mode_explicit": is_command_web_search_mode_explicit(c),
-            }
-        )
-    out.sort(key=lambda x: x["name"].lower())
+    out = _cached_listing("commands", load_commands(), _command_list_item)
     return jsonify(out)
 
 
+def _command_list_item(c):
+    web_search_mode = command_web_search_mode_for_api(c)
+    return {
+        "id": c.id,
+        "name": c.name,
+        "description": c.description,
+        "tags": c.tags,
+        "web_search_enabled": is_web_search_enabled(web_search_mode),
+        "web_search_mode": web_search_mode,
+        "web_search_mode_explicit": is_command_web_search_mode_explicit(c),
+    }
+
+
 @api_bp.route("/commands/<id>", methods=["GET"])
 def get_command(id):
     safe = _safe_rule_or_command_id(id)
     if not safe:
         return jsonify({"error": "invalid id"}), 400
-    cmds = load_commands()
-    c = cmds.get(safe)
+    c = get_command_by_id(safe)
     if not c:
         return jsonify({"error": "not found"}), 404
     out = {
@@ -341,7 +395,7 @@ def put_command(id):
     if context_ids is not None and not isinstance(context_ids, list):
         context_ids = []
     if context_ids is not None:
-        context_ids = [str(x) for x in context_ids if x and re.match(r"^[a-zA-Z0-9_-]+$", str(x))]
+        context_ids = [str(x) for x in context_ids if x and _ID_RE.match(str(x))]
     web_search_mode, err = _mode_from_payload(data, default_mode=WEB_SEARCH_MODE_OFF)
     if err:
         return jsonify({"error": err}), 400
@@ -356,11 +410,11 @@ def put_command(id):
     }
     if context_ids is not None:
         meta["context_ids"] = context_ids
-    text = f"---\n{yaml.safe_dump(meta, sort_keys=False).strip()}\n---\n\n{body}\n"
+    text = _frontmatter_text(meta, body)
     path = config.COMMANDS_DIR / f"{safe}.md"
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(text, encoding="utf-8")
-    _ = load_commands()
+    invalidate_commands()
     return jsonify(
         {
             "id": safe,
@@ -383,17 +437,26 @@ def delete_command(id):
     if not path.exists():
         return jsonify({"error": "not found"}), 404
     path.unlink()
+    invalidate_commands()
     return "", 204
 
 
 # ----- Memory (LLM-generated) -----
+_MEMORY_HAS_TAG = text("EXISTS (SELECT 1 FROM json_each(memory.tags) WHERE json_each.value = :tag)")
+
+
 @api_bp.route("/memory", methods=["GET"])
 def list_memory():
     tag = request.args.get("tag")
-    mems = Memory.query.order_by(Memory.created_at.desc()).all()
+    limit = request.args.get("limit", type=int)
+    q = Memory.query
     if tag:
-        mems = [m for m in mems if m.tags and tag in m.tags]
-    return jsonify([m.to_dict() for m in mems])
+        # Filter in SQLite rather than loading every row and checking tags in Python.
+        q = q.filter(_MEMORY_HAS_TAG.bindparams(tag=tag))
+    q = q.order_by(Memory.created_at.desc())
+    if limit and limit > 0:
+        q = q.limit(limit)
+    return jsonify([m.to_dict() for m in q.all()])
 
 
 @api_bp.route("/memory", methods=["POST"])
@@ -472,9 +535,14 @@ def create_chat():
     return jsonify(chat.to_dict()), 201
 
 
+def _fetch_chat_with_messages(chat_id):
+    """Load a chat and its messages together (selectin: one extra IN query, no lazy load later); 404 if missing."""
+    return Chat.query.options(selectinload(Chat.messages)).get_or_404(chat_id)
+
+
 @api_bp.route("/chats/<int:chat_id>", methods=["GET"])
 def get_chat(chat_id):
-    chat = Chat.query.get_or_404(chat_id)
+    chat = _fetch_chat_with_messages(chat_id)
     out = chat.to_dict()
     out["messages"] = [m.to_dict() for m in chat.messages]
     return jsonify(out)
@@ -510,31 +578,166 @@ def delete_chat(chat_id):
     return "", 204
 
 
+def _sse_event(payload):
+    """Encode one SSE data frame as bytes (orjson emits UTF-8 bytes directly)."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+# Chunk frames are the hot path; splice the encoded text into a fixed template instead of building a dict.
+_SSE_CHUNK_HEAD = b'data: {"t":"chunk","c":'
+_SSE_CHUNK_TAIL = b'}\n\n'
+
+
+def _sse_chunk(text):
+    """Encode a {'t': 'chunk', 'c': text} SSE frame."""
+    return _SSE_CHUNK_HEAD + orjson.dumps(text) + _SSE_CHUNK_TAIL
+
+
+# Content-Encoding: identity keeps compressing proxies from buffering the stream.
+# Connection is hop-by-hop and must not be set by a WSGI app, so it is left to the server.
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Content-Encoding": "identity",
+}
+
+
+def _disable_nagle():
+    """Best effort: set TCP_NODELAY on the client socket so small SSE frames go out immediately."""
+    sock = request.environ.get("werkzeug.socket") or request.environ.get("gunicorn.socket")
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass
+
+
+def _sse_response(events):
+    """Wrap an SSE event generator in a streaming response."""
+    _disable_nagle()
+    return Response(stream_with_context(events), mimetype="text/event-stream", headers=_SSE_HEADERS)
+
+
 def _stream_content_chunked(content, chunk_size=50):
     """Yield SSE chunk events for content in small pieces so the UI can display progressively."""
-    import time
     if not content:
         return
     for i in range(0, len(content), chunk_size):
-        yield f"data: {json.dumps({'t': 'chunk', 'c': content[i:i + chunk_size]})}\n\n"
+        yield _sse_chunk(content[i:i + chunk_size])
         # Small delay to simulate natural streaming (prevents all chunks arriving at once)
         time.sleep(0.01)
 
 
-def _stream_provider_chunks(provider_gen, chunk_size=50):
-    """Stream from provider generator, re-chunking into smaller pieces for smoother UI updates.
+def _stream_provider_chunks(provider_gen):
+    """Stream from provider generator, coalescing provider chunks into one SSE event until
+    config.SSE_COALESCE_CHARS are pending or config.SSE_COALESCE_MS have passed since the last event.
     Yields (sse_event, chunk_text) tuples so caller can accumulate full_content."""
-    buffer = ""
+    max_chars = config.SSE_COALESCE_CHARS
+    max_wait = config.SSE_COALESCE_MS / 1000.0
+    pending = []
+    pending_len = 0
+    last_flush = time.monotonic()
     for chunk in provider_gen:
-        buffer += chunk
-        # Yield accumulated buffer in small chunks
-        while len(buffer) >= chunk_size:
-            piece = buffer[:chunk_size]
-            buffer = buffer[chunk_size:]
-            yield (f"data: {json.dumps({'t': 'chunk', 'c': piece})}\n\n", piece)
-    # Yield remaining buffer
-    if buffer:
-        yield (f"data: {json.dumps({'t': 'chunk', 'c': buffer})}\n\n", buffer)
+        if not chunk:
+            continue
+        pending.append(chunk)
+        pending_len += len(chunk)
+        now = time.monotonic()
+        if pending_len >= max_chars or now - last_flush >= max_wait:
+            piece = "".join(pending)
+            pending.clear()
+            pending_len = 0
+            last_flush = now
+            yield (_sse_chunk(piece), piece)
+    if pending:
+        piece = "".join(pending)
+        yield (_sse_chunk(piece), piece)
+
+
+def _log_llm_prompt(messages_for_llm, label):
+    """Dump the outgoing prompt at DEBUG level; the preview is only built when DEBUG is enabled."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    parts = ["=" * 60 + f" {label} " + "=" * 60]
+    for msg in messages_for_llm:
+        role = msg.get("role", "")
+        c = msg.get("content")
+        content_preview = (c[:2000] if isinstance(c, str) else "[multimodal]")
+        if isinstance(c, str) and len(c) > 2000:
+            content_preview += "\n... [truncated]"
+        parts.append(f"--- {role.upper()} ---\n{content_preview}")
+    logger.debug("\n".join(parts))
+
+
+def _merge_context_ids(chat_context_ids, command):
+    """Return chat context ids followed by any command context ids not already included."""
+    extra = getattr(command, "context_ids", None) if command else None
+    if not extra:
+        return chat_context_ids or ()
+    return list(dict.fromkeys((*(chat_context_ids or ()), *extra)))
+
+
+def _schedule_memory_extraction(user_content, assistant_content, context_ids):
+    """Submit extract_and_store to the shared pool; skip it when too many jobs are pending."""
+    from backend.services.memory_store import extract_and_store
+    if not _MEMORY_SLOTS.acquire(blocking=False):
+        logger.warning("Memory extraction skipped: too many pending jobs")
+        return
+    future = _MEMORY_POOL.submit(
+        extract_and_store,
+        user_content,
+        assistant_content,
+        current_app._get_current_object(),
+        context_ids=context_ids,
+    )
+    future.add_done_callback(lambda _f: _MEMORY_SLOTS.release())
+
+
+def _recent_memory_contents(limit=10):
+    """Content of the newest memories, selected without loading full Memory rows (tags JSON etc.)."""
+    rows = db.session.query(Memory.content).order_by(Memory.created_at.desc()).limit(limit)
+    return [content for (content,) in rows]
+
+
+def _chat_history_rows(chat_id):
+    """Return (id, role, content, attachments) rows for the chat's user/assistant messages, oldest first.
+    Plain rows rather than Message objects: prompt assembly reads nothing else."""
+    return (
+        db.session.query(Message.id, Message.role, Message.content, Message.attachments)
+        .filter(Message.chat_id == chat_id, Message.role.in_(("user", "assistant")))
+        .order_by(Message.id)
+        .all()
+    )
+
+
+def _evaluate_attempt(command, user_instructions, attempt_content, model_id):
+    """Evaluate one command attempt with up to 3 tries; identical prompts hit the evaluator's verdict cache.
+    A timeout gives up at once: a slow evaluator will not get faster on retry."""
+    from backend.services.command_evaluator import evaluate_command_response
+    for eval_attempt in range(1, 4):
+        try:
+            return evaluate_command_response(
+                command.task,
+                command.success_criteria,
+                command.guidelines or "",
+                user_instructions,
+                attempt_content,
+                model_id,
+                timeout=60,
+            )
+        except TimeoutError:
+            return False, "Evaluation timed out"
+        except Exception:
+            if eval_attempt >= 3:
+                break
+    return False, "Evaluation failed after multiple attempts"
+
+
+def _command_instructions(content):
+    """Return the text after the leading /command word, or the whole content if nothing follows it."""
+    parts = content.split(None, 1)
+    return parts[1] if len(parts) > 1 else content
 
 
 def _title_fallback(first_user_content):
@@ -543,9 +746,35 @@ def _title_fallback(first_user_content):
     return t.strip() or "New chat"
 
 
+def _title_or_fallback(new_title, first_user_content):
+    """Use the generated title unless it is empty or the placeholder; otherwise the first-message fallback."""
+    new_title = (new_title or "").strip()
+    if new_title and new_title != "New chat":
+        return new_title[:80]
+    return _title_fallback(first_user_content)
+
+
+def _set_chat_title(chat_id, title):
+    """Stage a title update for chat_id in the current session (caller commits)."""
+    Chat.query.filter_by(id=chat_id).update(
+        {"title": title, "updated_at": datetime.utcnow()},
+        synchronize_session=False,
+    )
+
+
+@lru_cache(maxsize=1024)
+def _llm_title(model_id, prompt):
+    """Ask the chat_namer model for a title; raises on failure so fallbacks are never cached."""
+    from backend.providers import base as providers_base
+    messages = [{"role": "user", "content": prompt}]
+    title = "".join(providers_base.generate(messages, model_id, stream=True)).strip()
+    if not title:
+        raise ValueError("empty title")
+    return title[:80]
+
+
 def _generate_title(first_user_content):
     """Generate a short title from first ~100 chars using the chat_namer model from models.yaml."""
-    from backend.providers import base as providers_base
     model_id = get_chat_namer_model_id()
     if not model_id:
         return _title_fallback(first_user_content)
@@ -554,11 +783,8 @@ def _generate_title(first_user_content):
     if not title_prompt:
         title_prompt = "Generate an extremely short chat title: 2–4 words max, no punctuation. Reply with only the title, nothing else.\n\n{{SNIPPET}}"
     content = title_prompt.replace("{{SNIPPET}}", snippet)
-    messages = [{"role": "user", "content": content}]
     try:
-        title_parts = list(providers_base.generate(messages, model_id, stream=True))
-        title = "".join(title_parts).strip() or _title_fallback(first_user_content)
-        return (title[:80] if title else _title_fallback(first_user_content))
+        return _llm_title(model_id, content)
     except Exception:
         return _title_fallback(first_user_content)
 
@@ -586,22 +812,18 @@ def regenerate_message(chat_id):
     cmd_name, cmd_body = get_command_body_if_invoked(content)
     if cmd_name is not None and cmd_body is None:
         return jsonify({"error": f"Command /{cmd_name} not found."}), 400
+    user_instructions = _command_instructions(content) if cmd_name else (content or "")
     user_content_for_llm = (
-        f"Command instructions:\n{cmd_body}\n\nUser message: {content.split(None, 1)[1] if content.split() else content}"
+        f"Command instructions:\n{cmd_body}\n\nUser message: {user_instructions}"
         if cmd_body
         else content
     )
-    fallback_memories = [m.content for m in Memory.query.order_by(Memory.created_at.desc()).limit(10).all()]
+    fallback_memories = _recent_memory_contents()
     # Resolve active rules for this request (original user content, plus any rules referenced in the command body).
     commands_used = [cmd_name] if cmd_name else []
     rules_for_request = resolve_active_rules(content, commands_used)
-    cmds_regen = load_commands()
-    cmd_regen = cmds_regen.get(cmd_name) if cmd_name else None
-    effective_context_ids = list(chat.context_ids) if chat.context_ids else []
-    if cmd_regen and getattr(cmd_regen, "context_ids", None):
-        for cid in cmd_regen.context_ids:
-            if cid not in effective_context_ids:
-                effective_context_ids.append(cid)
+    cmd_regen = get_command_by_id(cmd_name)
+    effective_context_ids = _merge_context_ids(chat.context_ids, cmd_regen)
     system = build_system_message(
         effective_context_ids,
         rag_query=content,
@@ -611,9 +833,7 @@ def regenerate_message(chat_id):
     messages_for_llm = []
     if system:
         messages_for_llm.append({"role": "system", "content": system})
-    for m in chat.messages:
-        if m.role not in ("user", "assistant"):
-            continue
+    for m in _chat_history_rows(chat_id):
         if m.id == user_msg.id:
             content = message_to_llm_content(user_msg)
             if cmd_body:
@@ -625,6 +845,9 @@ def regenerate_message(chat_id):
             break
         messages_for_llm.append({"role": m.role, "content": message_to_llm_content(m) if m.role == "user" else m.content})
 
+    # Read chat fields now so the stream does not reload the chat after its commit.
+    chat_title = chat.title
+    chat_context_ids = chat.context_ids or []
     chat_web_search_mode = resolve_chat_web_search_mode(chat)
     base_request_web_search_mode = (
         resolve_command_web_search_mode(cmd_regen, chat_web_search_mode)
@@ -639,27 +862,29 @@ def regenerate_message(chat_id):
 
     def stream():
         from backend.providers import base as providers_base
-        from backend.services.command_evaluator import evaluate_command_response, execute_task_stream
+        from backend.services.command_evaluator import (
+            doomed_attempt_feedback,
+            execute_task_stream,
+        )
         meta = None
         try:
-            yield f"data: {json.dumps({'t': 'started'})}\n\n"
+            yield _sse_event({'t': 'started'})
             use_evaluation_regen = (
                 cmd_regen is not None
                 and getattr(cmd_regen, "task", None)
                 and getattr(cmd_regen, "success_criteria", None)
             )
-            user_instructions = content.split(None, 1)[1] if cmd_name and content.split() else (content or "")
-            messages_before_user = [{"role": m["role"], "content": m["content"]} for m in messages_for_llm[:-1]]
+            messages_before_user = messages_for_llm[:-1]
 
             if use_evaluation_regen:
-                yield f"data: {json.dumps({'t': 'executing', 'msg': 'Completing task...'})}\n\n"
+                yield _sse_event({'t': 'executing', 'msg': 'Completing task...'})
                 full_content = ""
                 previous_feedback = None
                 web_search_meta = None
                 command_web_search_mode = resolved_request_web_search_mode
                 for attempt in range(1, 4):
-                    buffer = []
-                    for item in execute_task_stream(
+                    buf = io.StringIO()
+                    task_stream = execute_task_stream(
                         cmd_regen,
                         user_instructions,
                         system,
@@ -667,49 +892,39 @@ def regenerate_message(chat_id):
                         model_id,
                         previous_feedback=previous_feedback,
                         web_search_mode=command_web_search_mode,
-                    ):
+                    )
+                    for item in task_stream:
                         if isinstance(item, tuple):
                             if item[0] == "status":
-                                yield f"data: {json.dumps({'t': 'executing', 'msg': item[1]})}\n\n"
+                                yield _sse_event({'t': 'executing', 'msg': item[1]})
                             elif item[0] == "meta":
                                 web_search_meta = item[1]
                             elif item[0] == "chunk":
-                                buffer.append(item[1])
+                                buf.write(item[1])
                         else:
-                            buffer.append(item)
-                    attempt_content = "".join(buffer)
-                    yield f"data: {json.dumps({'t': 'evaluating', 'attempt': attempt})}\n\n"
-                    passed = False
-                    feedback = ""
-                    for eval_attempt in range(1, 4):
-                        try:
-                            passed, feedback = evaluate_command_response(
-                                cmd_regen.task,
-                                cmd_regen.success_criteria,
-                                cmd_regen.guidelines or "",
-                                user_instructions,
-                                attempt_content,
-                                model_id,
-                                timeout=60,
-                            )
-                            break
-                        except (TimeoutError, Exception):
-                            if eval_attempt >= 3:
-                                passed = False
-                                feedback = "Evaluation failed after multiple attempts"
-                                break
+                            buf.write(item)
+                    attempt_content = buf.getvalue()
+                    # Earlier attempts that are only a short refusal (or empty) skip evaluation.
+                    early_feedback = doomed_attempt_feedback(attempt_content) if attempt < 3 else None
+                    if early_feedback:
+                        # Doomed attempt: skip the evaluation call and retry straight away.
+                        previous_feedback = early_feedback
+                        yield _sse_event({'t': 'retrying', 'attempt': attempt + 1})
+                        continue
+                    yield _sse_event({'t': 'evaluating', 'attempt': attempt})
+                    passed, feedback = _evaluate_attempt(cmd_regen, user_instructions, attempt_content, model_id)
                     if passed:
-                        for chunk in buffer:
-                            yield f"data: {json.dumps({'t': 'chunk', 'c': chunk})}\n\n"
+                        if attempt_content:
+                            yield _sse_chunk(attempt_content)
                         full_content = attempt_content
-                        yield f"data: {json.dumps({'t': 'passed', 'attempt': attempt})}\n\n"
+                        yield _sse_event({'t': 'passed', 'attempt': attempt})
                         break
                     elif attempt < 3:
                         previous_feedback = feedback
-                        yield f"data: {json.dumps({'t': 'retrying', 'attempt': attempt + 1})}\n\n"
+                        yield _sse_event({'t': 'retrying', 'attempt': attempt + 1})
                     else:
-                        for chunk in buffer:
-                            yield f"data: {json.dumps({'t': 'chunk', 'c': chunk})}\n\n"
+                        if attempt_content:
+                            yield _sse_chunk(attempt_content)
                         full_content = attempt_content
                 if web_search_meta is not None:
                     meta = {"web_search": web_search_meta}
@@ -724,59 +939,43 @@ def regenerate_message(chat_id):
                             web_search_mode=web_search_mode,
                         ):
                             if event[0] == "status":
-                                yield f"data: {json.dumps({'t': 'executing', 'msg': event[1]})}\n\n"
+                                yield _sse_event({'t': 'executing', 'msg': event[1]})
                             elif event[0] == "result":
                                 full_content, web_search_meta = event[1]
                                 break
                         if full_content is None:
                             full_content = ""
                     except Exception as e:
-                        yield f"data: {json.dumps({'t': 'error', 'error': str(e)})}\n\n"
+                        yield _sse_event({'t': 'error', 'error': str(e)})
                         return
                     if full_content:
                         for sse in _stream_content_chunked(full_content):
                             yield sse
                     meta = {"web_search": web_search_meta} if web_search_meta else None
                 else:
-                    print("\n" + "=" * 60 + " LLM PROMPT (regenerate) " + "=" * 60)
-                    for msg in messages_for_llm:
-                        role = msg.get("role", "")
-                        c = msg.get("content")
-                        content_preview = (c[:2000] if isinstance(c, str) else "[multimodal]")
-                        if isinstance(c, str) and len(c) > 2000:
-                            content_preview += "\n... [truncated]"
-                        print(f"\n--- {role.upper()} ---\n{content_preview}")
-                    print("=" * 60 + "\n")
-                    buffer = []
+                    _log_llm_prompt(messages_for_llm, "LLM PROMPT (regenerate)")
+                    buf = io.StringIO()
                     for sse, chunk_text in _stream_provider_chunks(providers_base.generate(messages_for_llm, model_id, stream=True)):
-                        buffer.append(chunk_text)
+                        buf.write(chunk_text)
                         yield sse
-                    full_content = "".join(buffer)
+                    full_content = buf.getvalue()
             assistant_msg = Message(chat_id=chat_id, role="assistant", content=full_content, meta=meta)
             db.session.add(assistant_msg)
+            db.session.flush()
+            assistant_id = assistant_msg.id
             db.session.commit()
-            from backend.services.memory_store import extract_and_store
-            threading.Thread(
-                target=extract_and_store,
-                args=(content, full_content, current_app._get_current_object()),
-                kwargs={"context_ids": chat.context_ids or []},
-                daemon=True,
-            ).start()
-            yield f"data: {json.dumps({'t': 'done', 'id': assistant_msg.id, 'title': chat.title})}\n\n"
+            _schedule_memory_extraction(content, full_content, chat_context_ids)
+            yield _sse_event({'t': 'done', 'id': assistant_id, 'title': chat_title})
         except Exception as e:
-            yield f"data: {json.dumps({'t': 'error', 'error': str(e)})}\n\n"
+            yield _sse_event({'t': 'error', 'error': str(e)})
 
-    return Response(
-        stream_with_context(stream()),
-        mimetype="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-    )
+    return _sse_response(stream())
 
 
 @api_bp.route("/chats/<int:chat_id>/messages/<int:message_id>", methods=["PATCH"])
 def patch_message(chat_id, message_id):
     """Update a message's content and delete all messages after it in the chat."""
-    chat = Chat.query.get_or_404(chat_id)
+    Chat.query.get_or_404(chat_id)
     msg = Message.query.filter_by(chat_id=chat_id, id=message_id).first_or_404()
     data = request.get_json() or {}
     content = (data.get("content") or "").strip()
@@ -785,8 +984,9 @@ def patch_message(chat_id, message_id):
     # Delete all messages after this one (by id order)
     Message.query.filter(Message.chat_id == chat_id, Message.id > message_id).delete(synchronize_session=False)
     db.session.commit()
-    db.session.refresh(chat)
-    out = [m.to_dict() for m in chat.messages]
+    # Query the remaining messages directly instead of refreshing the chat and reloading its relationship.
+    remaining = Message.query.filter_by(chat_id=chat_id).order_by(Message.id).all()
+    out = [m.to_dict() for m in remaining]
     return jsonify(out)
 
 
@@ -830,6 +1030,7 @@ def add_message(chat_id):
     cmd_name, cmd_body = get_command_body_if_invoked(content)
     if cmd_name is not None and cmd_body is None:
         return jsonify({"error": f"Command /{cmd_name} not found. Please retry with a valid command or without a command."}), 400
+    user_instructions = _command_instructions(content) if cmd_name else content
 
     if not model_id:
         return jsonify({"error": "model_id is required"}), 400
@@ -863,7 +1064,7 @@ def add_message(chat_id):
 
     # Build user content for LLM: if command, prepend command body
     if cmd_body:
-        user_content_for_llm = f"Command instructions:\n{cmd_body}\n\nUser message: {content.split(None, 1)[1] if content.split() else content}"
+        user_content_for_llm = f"Command instructions:\n{cmd_body}\n\nUser message: {user_instructions}"
     else:
         user_content_for_llm = content
 
@@ -873,18 +1074,13 @@ def add_message(chat_id):
     else:
         current_user_content = user_content_for_llm
 
-    fallback_memories = [m.content for m in Memory.query.order_by(Memory.created_at.desc()).limit(10).all()]
+    fallback_memories = _recent_memory_contents()
     # Resolve rules based on original user content and any command body.
     commands_used = [cmd_name] if cmd_name else []
     rules_for_request = resolve_active_rules(content, commands_used)
     # When a command is used, merge chat context_ids with command's context_ids (command contexts auto-included).
-    cmds = load_commands()
-    cmd = cmds.get(cmd_name) if cmd_name else None
-    effective_context_ids = list(chat.context_ids) if chat.context_ids else []
-    if cmd and getattr(cmd, "context_ids", None):
-        for cid in cmd.context_ids:
-            if cid not in effective_context_ids:
-                effective_context_ids.append(cid)
+    cmd = get_command_by_id(cmd_name)
+    effective_context_ids = _merge_context_ids(chat.context_ids, cmd)
     system = build_system_message(
         effective_context_ids,
         rag_query=content,
@@ -894,22 +1090,24 @@ def add_message(chat_id):
     messages_for_llm = []
     if system:
         messages_for_llm.append({"role": "system", "content": system})
-    for m in chat.messages:
+    history = _chat_history_rows(chat_id)
+    for m in history:
         if m.id == user_msg.id:
             continue
-        if m.role in ("user", "assistant"):
-            messages_for_llm.append({"role": m.role, "content": message_to_llm_content(m) if m.role == "user" else m.content})
+        messages_for_llm.append({"role": m.role, "content": message_to_llm_content(m) if m.role == "user" else m.content})
     messages_for_llm.append({"role": "user", "content": current_user_content})
 
-    cmds = load_commands()
-    cmd = cmds.get(cmd_name) if cmd_name else None
+    # Read chat fields now so the stream does not reload the chat after its commit.
+    # The user message is already in history, so 1 means this is the first reply.
+    chat_title = chat.title
+    needs_title = len(history) == 1 or not chat_title or chat_title.strip() == "New chat"
+    chat_context_ids = chat.context_ids or []
     use_evaluation = (
         cmd is not None
         and getattr(cmd, "task", None)
         and getattr(cmd, "success_criteria", None)
     )
-    user_instructions = content.split(None, 1)[1] if cmd_name and content.split() else (content or "")
-    messages_before_user = [{"role": m["role"], "content": m["content"]} for m in messages_for_llm[:-1]]
+    messages_before_user = messages_for_llm[:-1]
     chat_web_search_mode = resolve_chat_web_search_mode(chat)
     base_request_web_search_mode = (
         resolve_command_web_search_mode(cmd, chat_web_search_mode)
@@ -924,22 +1122,26 @@ def add_message(chat_id):
 
     def stream():
         from backend.providers import base as providers_base
-        from backend.services.command_evaluator import evaluate_command_response, execute_task_stream
+        from backend.services.command_evaluator import (
+            doomed_attempt_feedback,
+            execute_task_stream,
+        )
 
+        title_future = _TITLE_POOL.submit(_generate_title, content) if needs_title else None
         try:
             meta = None
-            yield f"data: {json.dumps({'t': 'started'})}\n\n"
+            yield _sse_event({'t': 'started'})
 
             if use_evaluation:
-                yield f"data: {json.dumps({'t': 'executing', 'msg': 'Completing task...'})}\n\n"
+                yield _sse_event({'t': 'executing', 'msg': 'Completing task...'})
                 full_content = ""
                 previous_feedback = None
                 web_search_meta = None
                 command_web_search_mode = resolved_request_web_search_mode
                 for attempt in range(1, 4):
                     # Collect chunks without yielding them yet - wait for evaluation
-                    buffer = []
-                    for item in execute_task_stream(
+                    buf = io.StringIO()
+                    task_stream = execute_task_stream(
                         cmd,
                         user_instructions,
                         system,
@@ -947,54 +1149,44 @@ def add_message(chat_id):
                         model_id,
                         previous_feedback=previous_feedback,
                         web_search_mode=command_web_search_mode,
-                    ):
+                    )
+                    for item in task_stream:
                         if isinstance(item, tuple):
                             if item[0] == "status":
-                                yield f"data: {json.dumps({'t': 'executing', 'msg': item[1]})}\n\n"
+                                yield _sse_event({'t': 'executing', 'msg': item[1]})
                             elif item[0] == "meta":
                                 web_search_meta = item[1]
                             elif item[0] == "chunk":
-                                buffer.append(item[1])
+                                buf.write(item[1])
                         else:
-                            buffer.append(item)
-                    attempt_content = "".join(buffer)
-
-                    yield f"data: {json.dumps({'t': 'evaluating', 'attempt': attempt})}\n\n"
-                    passed = False
-                    feedback = ""
-                    for eval_attempt in range(1, 4):
-                        try:
-                            passed, feedback = evaluate_command_response(
-                                cmd.task,
-                                cmd.success_criteria,
-                                cmd.guidelines or "",
-                                user_instructions,
-                                attempt_content,
-                                model_id,
-                                timeout=60,
-                            )
-                            break
-                        except (TimeoutError, Exception):
-                            if eval_attempt >= 3:
-                                passed = False
-                                feedback = "Evaluation failed after multiple attempts"
-                                break
+                            buf.write(item)
+                    attempt_content = buf.getvalue()
+                    # Earlier attempts that are only a short refusal (or empty) skip evaluation.
+                    early_feedback = doomed_attempt_feedback(attempt_content) if attempt < 3 else None
+                    if early_feedback:
+                        # Doomed attempt: skip the evaluation call and retry straight away.
+                        previous_feedback = early_feedback
+                        yield _sse_event({'t': 'retrying', 'attempt': attempt + 1})
+                        continue
+
+                    yield _sse_event({'t': 'evaluating', 'attempt': attempt})
+                    passed, feedback = _evaluate_attempt(cmd, user_instructions, attempt_content, model_id)
 
                     if passed:
-                        # Success: yield all chunks now, then break
-                        for chunk in buffer:
-                            yield f"data: {json.dumps({'t': 'chunk', 'c': chunk})}\n\n"
+                        # Success: send the whole attempt now, then break
+                        if attempt_content:
+                            yield _sse_chunk(attempt_content)
                         full_content = attempt_content
-                        yield f"data: {json.dumps({'t': 'passed', 'attempt': attempt})}\n\n"
+                        yield _sse_event({'t': 'passed', 'attempt': attempt})
                         break
                     elif attempt < 3:
                         # Failed but more attempts left: don't show this attempt, retry
                         previous_feedback = feedback
-                        yield f"data: {json.dumps({'t': 'retrying', 'attempt': attempt + 1})}\n\n"
+                        yield _sse_event({'t': 'retrying', 'attempt': attempt + 1})
                     else:
                         # Final attempt failed: show it anyway
-                        for chunk in buffer:
-                            yield f"data: {json.dumps({'t': 'chunk', 'c': chunk})}\n\n"
+                        if attempt_content:
+                            yield _sse_chunk(attempt_content)
                         full_content = attempt_content
                 if web_search_meta is not None:
                     meta = {"web_search": web_search_meta}
@@ -1009,67 +1201,59 @@ def add_message(chat_id):
                             web_search_mode=web_search_mode,
                         ):
                             if event[0] == "status":
-                                yield f"data: {json.dumps({'t': 'executing', 'msg': event[1]})}\n\n"
+                                yield _sse_event({'t': 'executing', 'msg': event[1]})
                             elif event[0] == "result":
                                 full_content, web_search_meta = event[1]
                                 break
                         if full_content is None:
                             full_content = ""
                     except Exception as e:
-                        yield f"data: {json.dumps({'t': 'error', 'error': str(e)})}\n\n"
+                        yield _sse_event({'t': 'error', 'error': str(e)})
                         return
                     if full_content:
                         for sse in _stream_content_chunked(full_content):
                             yield sse
                     meta = {"web_search": web_search_meta} if web_search_meta else None
                 else:
-                    print("\n" + "=" * 60 + " LLM PROMPT " + "=" * 60)
-                    for msg in messages_for_llm:
-                        role = msg.get("role", "")
-                        c = msg.get("content")
-                        content_preview = (c[:2000] if isinstance(c, str) else "[multimodal]")
-                        if isinstance(c, str) and len(c) > 2000:
-                            content_preview += "\n... [truncated]"
-                        print(f"\n--- {role.upper()} ---\n{content_preview}")
-                    print("=" * 60 + "\n")
-                    buffer = []
+                    _log_llm_prompt(messages_for_llm, "LLM PROMPT")
+                    buf = io.StringIO()
                     for sse, chunk_text in _stream_provider_chunks(providers_base.generate(messages_for_llm, model_id, stream=True)):
-                        buffer.append(chunk_text)
+                        buf.write(chunk_text)
                         yield sse
-                    full_content = "".join(buffer)
-
+                    full_content = buf.getvalue()
+
+            # A title that is already generated goes out with done; otherwise done carries no title
+            # and the title follows in its own 'title' event.
+            title_to_send = chat_title if title_future is None else None
+            if title_future is not None and title_future.done():
+                title_to_send = _title_or_fallback(title_future.result(), content)
+                _set_chat_title(chat_id, title_to_send)
+                title_future = None
             assistant_msg = Message(chat_id=chat_id, role="assistant", content=full_content, meta=meta)
             db.session.add(assistant_msg)
             db.session.flush()
-            msg_count = Message.query.filter_by(chat_id=chat_id).count()
-            is_first_reply = msg_count == 2
-            needs_title = (not chat.title or (chat.title or "").strip() == "New chat")
-            if is_first_reply or needs_title:
-                new_title = _generate_title(content)
-                if new_title and new_title.strip() and (new_title.strip() != "New chat"):
-                    title_to_send = new_title.strip()[:80]
-                else:
-                    title_to_send = _title_fallback(content)
-                Chat.query.filter_by(id=chat_id).update(
-                    {"title": title_to_send, "updated_at": datetime.utcnow()},
-                    synchronize_session=False,
-                )
-            else:
-                title_to_send = chat.title
+            assistant_id = assistant_msg.id
             db.session.commit()
-            from backend.services.memory_store import extract_and_store
-            threading.Thread(
-                target=extract_and_store,
-                args=(content, full_content, current_app._get_current_object()),
-                kwargs={"context_ids": chat.context_ids or []},
-                daemon=True,
-            ).start()
-            yield f"data: {json.dumps({'t': 'done', 'id': assistant_msg.id, 'title': title_to_send})}\n\n"
+            _schedule_memory_extraction(content, full_content, chat_context_ids)
+            yield _sse_event({'t': 'done', 'id': assistant_id, 'title': title_to_send})
         except Exception as e:
-            yield f"data: {json.dumps({'t': 'error', 'error': str(e)})}\n\n"
-
-    return Response(
-        stream_with_context(stream()),
-        mimetype="text/event-stream",
-        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
-    )
+            yield _sse_event({'t': 'error', 'error': str(e)})
+            return
+
+        if title_future is not None:
+            try:
+                new_title = title_future.result(timeout=config.TITLE_TIMEOUT_SECONDS)
+            except FutureTimeoutError:
+                logger.warning("Chat title generation timed out; using fallback title")
+                new_title = None
+            title = _title_or_fallback(new_title, content)
+            try:
+                _set_chat_title(chat_id, title)
+                db.session.commit()
+            except Exception:
+                logger.exception("Failed to save generated title for chat %s", chat_id)
+                db.session.rollback()
+                return
+            yield _sse_event({'t': 'title', 'title': title})
+
+    return _sse_response(stream())
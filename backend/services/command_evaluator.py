@@ -1,15 +1,48 @@
 """Command evaluation: evaluate assistant response against success criteria; retry logic is in api.py."""
+import atexit
+import hashlib
+import io
+import re
+import threading
+import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from typing import Any, Dict, List, Optional, Tuple
 
+import config
 from backend.services.prompt_builder import Command
-from backend.services.prompt_loader import load_prompt
+from backend.services.prompt_loader import load_prompt, render_prompt
 from backend.services.web_search_mode import (
     WEB_SEARCH_MODE_OFF,
     is_web_search_enabled,
     normalize_web_search_mode,
 )
 
+# Shared pool for evaluation calls; the per-call executor used to create and join a thread every time.
+_EVAL_EXECUTOR = ThreadPoolExecutor(max_workers=config.EVAL_POOL_SIZE, thread_name_prefix="eval")
+atexit.register(_EVAL_EXECUTOR.shutdown, wait=False, cancel_futures=True)
+
+# (model id, blake2b of the full evaluation prompt) -> (passed, feedback), most recent last.
+_VERDICT_CACHE: "OrderedDict[Tuple[str, bytes], Tuple[bool, str]]" = OrderedDict()
+_VERDICT_CACHE_MAX = 512
+_VERDICT_CACHE_LOCK = threading.Lock()
+
+# Verdict: whichever of YES / NO occurs first in the reply (substring match, case-insensitive).
+_VERDICT_RE = re.compile(r"YES|NO", re.IGNORECASE)
+
+# Attempts longer than this always go to evaluation; a bare refusal is one short sentence.
+_DOOMED_ATTEMPT_MAX_CHARS = 200
+
+# Attempts that never pass evaluation: the whole reply is a single refusal sentence.
+# ':' and ';' are excluded so "I can't provide X, but here is Y: ..." still gets evaluated.
+_DOOMED_ATTEMPT_RE = re.compile(
+    r"\s*(?:(?:I['’]m\s+)?sorry,?\s+(?:but\s+)?)?"
+    r"(?:I\s+(?:cannot|can\s?not|can['’]t|won['’]t|am\s+unable\s+to)|I['’]m\s+(?:unable|not\s+able)\s+to)"
+    r"\s+(?:help|assist|comply|provide|fulfil)"
+    r"[^.!?:;\n]*[.!]?\s*\Z",
+    re.IGNORECASE,
+)
+
 
 def execute_task_stream(
     command: Command,
@@ -36,15 +69,16 @@ def execute_task_stream(
             f"Previous attempt did not meet success criteria. Evaluation feedback: {previous_feedback}\n\n"
             "Please try again, addressing the feedback.\n\n"
         )
-    template = load_prompt("command_task")
-    if template:
-        user_content = (
-            template.replace("{{PREVIOUS_FEEDBACK}}", previous_feedback_block)
-            .replace("{{TASK}}", task)
-            .replace("{{GUIDELINES}}", guidelines)
-            .replace("{{USER_INSTRUCTIONS}}", user_instructions)
-        )
-    else:
+    user_content = render_prompt(
+        "command_task",
+        {
+            "PREVIOUS_FEEDBACK": previous_feedback_block,
+            "TASK": task,
+            "GUIDELINES": guidelines,
+            "USER_INSTRUCTIONS": user_instructions,
+        },
+    )
+    if not user_content:
         user_content = f"## Task\n\n{task}\n\n## Guidelines\n\n{guidelines}\n\n## User message\n\n{user_instructions}"
         if previous_feedback_block:
             user_content = previous_feedback_block + user_content
@@ -78,6 +112,20 @@ def execute_task_stream(
             yield ("meta", web_search_meta or [])
             return
 
+def doomed_attempt_feedback(attempt: str) -> Optional[str]:
+    """Return retry feedback when an attempt cannot pass evaluation, else None.
+
+    Cheap pre-check so empty replies and short, bare refusals skip the evaluation call entirely.
+    Anything longer or with content after the refusal is left to the evaluator.
+    """
+    text = attempt.strip()
+    if not text:
+        return "The previous attempt returned an empty response."
+    if len(text) <= _DOOMED_ATTEMPT_MAX_CHARS and _DOOMED_ATTEMPT_RE.match(text):
+        return "The previous attempt declined the task instead of completing it."
+    return None
+
+
 def _get_evaluation_prompt():
     """Load evaluation prompt from prompts/command_evaluation.md; fallback to inline if missing."""
     prompt = load_prompt("command_evaluation")
@@ -90,6 +138,86 @@ def _get_evaluation_prompt():
     )
 
 
+def _evaluation_prompt(
+    task: str,
+    success_criteria: str,
+    guidelines: str,
+    user_instructions: str,
+    assistant_response: str,
+) -> str:
+    return _get_evaluation_prompt().format(
+        task=task or "(none)",
+        success_criteria=success_criteria or "(none)",
+        guidelines=guidelines or "(none)",
+        user_instructions=user_instructions or "(none)",
+        assistant_response=assistant_response or "(none)",
+    )
+
+
+def _evaluation_events(prompt: str, model_id: str, timeout: float):
+    """Stream the evaluator reply for prompt: yields ("chunk", text) as it arrives, then ("verdict", passed, feedback).
+
+    Stops reading the stream once the deadline passes so a slow evaluator does
+    not keep its thread busy after the caller has given up.
+
+    Raises:
+        TimeoutError: If the reply is still streaming after timeout seconds.
+    """
+    from backend.providers import base as providers_base
+
+    deadline = time.monotonic() + timeout
+    stream = providers_base.generate([{"role": "user", "content": prompt}], model_id, stream=True)
+    buf = io.StringIO()
+    verdict = None
+    # Last two chars of the text scanned so far, so a YES/NO split across chunks is still found.
+    tail = ""
+    try:
+        for chunk in stream:
+            buf.write(chunk)
+            yield ("chunk", chunk)
+            if verdict is None:
+                window = tail + chunk
+                m = _VERDICT_RE.search(window)
+                if m:
+                    verdict = m.group(0).upper() == "YES"
+                    if verdict:
+                        # A pass needs no feedback; stop reading the explanation.
+                        break
+                else:
+                    tail = window[-2:]
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Evaluation timed out after {timeout} seconds")
+    finally:
+        stream.close()
+
+    raw = buf.getvalue().strip()
+    if not raw:
+        yield ("verdict", False, "Evaluation returned no response.")
+        return
+    yield ("verdict", bool(verdict), raw)
+
+
+def evaluate_command_response_stream(
+    task: str,
+    success_criteria: str,
+    guidelines: str,
+    user_instructions: str,
+    assistant_response: str,
+    model_id: str,
+    timeout: int = 60,
+):
+    """Streaming variant of evaluate_command_response, run in the caller's thread.
+
+    Yields ("chunk", text) for evaluator output as it arrives, then a final
+    ("verdict", passed, feedback).
+
+    Raises:
+        TimeoutError: If evaluation exceeds timeout.
+    """
+    prompt = _evaluation_prompt(task, success_criteria, guidelines, user_instructions, assistant_response)
+    yield from _evaluation_events(prompt, model_id, timeout)
+
+
 def evaluate_command_response(
     task: str,
     success_criteria: str,
@@ -110,40 +238,32 @@ def evaluate_command_response(
     Raises:
         TimeoutError: If evaluation exceeds timeout.
     """
-    from backend.providers import base as providers_base
-
-    prompt = _get_evaluation_prompt().format(
-        task=task or "(none)",
-        success_criteria=success_criteria or "(none)",
-        guidelines=guidelines or "(none)",
-        user_instructions=user_instructions or "(none)",
-        assistant_response=assistant_response or "(none)",
-    )
-    messages = [{"role": "user", "content": prompt}]
+    prompt = _evaluation_prompt(task, success_criteria, guidelines, user_instructions, assistant_response)
+    cache_key = None
+    if config.EVAL_CACHE:
+        cache_key = (model_id, hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest())
+        with _VERDICT_CACHE_LOCK:
+            cached = _VERDICT_CACHE.get(cache_key)
+            if cached is not None:
+                _VERDICT_CACHE.move_to_end(cache_key)
+                return cached
 
     def _run():
-        parts = list(providers_base.generate(messages, model_id, stream=True))
-        return "".join(parts).strip()
-
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(_run)
-        try:
-            raw = future.result(timeout=timeout)
-        except FuturesTimeoutError:
-            raise TimeoutError(f"Evaluation timed out after {timeout} seconds")
-
-    if not raw:
+        for event in _evaluation_events(prompt, model_id, timeout):
+            if event[0] == "verdict":
+                return event[1], event[2]
         return False, "Evaluation returned no response."
 
-    raw_upper = raw.upper()
-    yes_pos = raw_upper.find("YES")
-    no_pos = raw_upper.find("NO")
-    if yes_pos == -1 and no_pos == -1:
-        passed = False
-    elif yes_pos == -1:
-        passed = False
-    elif no_pos == -1:
-        passed = True
-    else:
-        passed = yes_pos < no_pos
-    return passed, raw.strip()
+    future = _EVAL_EXECUTOR.submit(_run)
+    try:
+        result = future.result(timeout=timeout)
+    except FuturesTimeoutError:
+        # Drops it if still queued; a running _run stops at its deadline check.
+        future.cancel()
+        raise TimeoutError(f"Evaluation timed out after {timeout} seconds")
+    if cache_key is not None and result[1] != "Evaluation returned no response.":
+        with _VERDICT_CACHE_LOCK:
+            _VERDICT_CACHE[cache_key] = result
+            if len(_VERDICT_CACHE) > _VERDICT_CACHE_MAX:
+                _VERDICT_CACHE.popitem(last=False)
+    return result
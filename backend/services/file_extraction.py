@@ -1,9 +1,15 @@
 """Extract text or image data from uploaded files for file-based prompting."""
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import config
 
+try:
+    import fitz  # PyMuPDF: optional, C-backed and much faster than pypdf for text extraction
+except ImportError:
+    fitz = None
+
 
 # MIME types we treat as images (no text extraction; pass to vision API).
 IMAGE_EXTENSIONS = frozenset({".png", ".jpg", ".jpeg", ".webp", ".gif"})
@@ -29,21 +35,45 @@ def _mime_for_image(ext: str, content_type: str | None) -> str:
     return {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp", ".gif": "image/gif"}.get(ext, "image/png")
 
 
+_TRUNCATED_SUFFIX = "\n\n[Truncated...]"
+
+
 def _truncate(text: str, max_chars: int) -> str:
     if len(text) <= max_chars:
         return text
-    return text[:max_chars] + "\n\n[Truncated...]"
+    return text[:max_chars] + _TRUNCATED_SUFFIX
+
+
+def _extract_pdf_pymupdf(data: bytes, max_chars: int) -> str:
+    parts = []
+    running_len = 0
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        for page in doc:
+            if running_len >= max_chars:
+                break
+            t = page.get_text() or ""
+            parts.append(t)
+            running_len += len(t) + 2  # "\n\n" separator
+    return _truncate("\n\n".join(parts), max_chars)
 
 
 def _extract_pdf(data: bytes, max_chars: int) -> str:
+    if fitz is not None:
+        try:
+            return _extract_pdf_pymupdf(data, max_chars)
+        except Exception:
+            pass  # fall back to pypdf
     try:
         from pypdf import PdfReader
         reader = PdfReader(BytesIO(data))
         parts = []
+        running_len = 0
         for page in reader.pages:
-            if sum(len(p) for p in parts) >= max_chars:
+            if running_len >= max_chars:
                 break
-            parts.append(page.extract_text() or "")
+            t = page.extract_text() or ""
+            parts.append(t)
+            running_len += len(t) + 2  # "\n\n" separator
         text = "\n\n".join(parts)
         return _truncate(text, max_chars)
     except Exception:
@@ -63,12 +93,55 @@ def _extract_docx(data: bytes, max_chars: int) -> str:
 
 def _extract_plain_text(data: bytes, max_chars: int) -> str:
     try:
-        text = data.decode("utf-8", errors="replace")
-        return _truncate(text, max_chars)
+        # A UTF-8 character is at most 4 bytes, so the first max_chars * 4 bytes hold at least
+        # max_chars characters: decode only those (through a memoryview, no bytes copy).
+        cap = max_chars * 4
+        if len(data) <= cap:
+            return _truncate(data.decode("utf-8", errors="replace"), max_chars)
+        text = str(memoryview(data)[:cap], "utf-8", "replace")
+        return text[:max_chars] + _TRUNCATED_SUFFIX
     except Exception:
         return ""
 
 
+# Shared pool for extracting the files of one multi-attachment message in parallel.
+_EXTRACT_POOL = ThreadPoolExecutor(max_workers=max(1, config.MAX_ATTACHMENTS_PER_MESSAGE), thread_name_prefix="extract")
+
+# Text extractors by extension; anything else allowed is decoded as plain text.
+EXTRACTORS = {
+    ".pdf": _extract_pdf,
+    ".docx": _extract_docx,
+}
+
+
+def _process_one(data: bytes, filename: str, content_type: str | None, max_chars: int) -> tuple[dict, dict]:
+    """Return (attachment_for_db, content_part_for_llm) for one validated file."""
+    ext = _extension(filename)
+    if _is_image(ext, content_type):
+        b64 = base64.standard_b64encode(data).decode("ascii")
+        mime = _mime_for_image(ext, content_type)
+        data_url = f"data:{mime};base64,{b64}"
+        attachment = {
+            "type": "image",
+            "filename": filename,
+            "extracted_text": None,
+            "image_data": b64,
+        }
+        return attachment, {"type": "image_url", "image_url": {"url": data_url}}
+
+    # Document: extract text (.txt, .md, .py or any other allowed doc type falls back to plain text)
+    text = EXTRACTORS.get(ext, _extract_plain_text)(data, max_chars)
+    if not text.strip():
+        text = f"[Could not extract: {filename}]"
+    attachment = {
+        "type": "text",
+        "filename": filename,
+        "extracted_text": text,
+        "image_data": None,
+    }
+    return attachment, {"type": "text", "text": f"[Attachment: {filename}]\n{text}"}
+
+
 def extract_attachments(files: list[tuple[bytes, str, str | None]]) -> tuple[list[dict], list[dict]]:
     """
     Process a list of (file_bytes, filename, content_type) and return:
@@ -85,44 +158,21 @@ def extract_attachments(files: list[tuple[bytes, str, str | None]]) -> tuple[lis
     attachments_for_db: list[dict] = []
     content_parts_for_llm: list[dict] = []
 
-    for data, filename, content_type in files:
+    # Validate every file before extracting any, so a bad last file doesn't waste work on the others.
+    for data, filename, _ in files:
         if len(data) > config.MAX_ATTACHMENT_SIZE_BYTES:
             raise ValueError(f"File too large: {filename} (max {config.MAX_ATTACHMENT_SIZE_BYTES} bytes)")
-
         ext = _extension(filename)
         if ext not in config.ALLOWED_ATTACHMENT_EXTENSIONS:
             raise ValueError(f"File type not allowed: {filename} (extension {ext or 'none'})")
 
-        if _is_image(ext, content_type):
-            b64 = base64.standard_b64encode(data).decode("ascii")
-            mime = _mime_for_image(ext, content_type)
-            data_url = f"data:{mime};base64,{b64}"
-            attachments_for_db.append({
-                "type": "image",
-                "filename": filename,
-                "extracted_text": None,
-                "image_data": b64,
-            })
-            content_parts_for_llm.append({"type": "image_url", "image_url": {"url": data_url}})
-            continue
-
-        # Document: extract text
-        if ext == ".pdf":
-            text = _extract_pdf(data, max_chars)
-        elif ext == ".docx":
-            text = _extract_docx(data, max_chars)
-        else:
-            # .txt, .md, .py or any other allowed doc type
-            text = _extract_plain_text(data, max_chars)
-
-        if not text.strip():
-            text = f"[Could not extract: {filename}]"
-        attachments_for_db.append({
-            "type": "text",
-            "filename": filename,
-            "extracted_text": text,
-            "image_data": None,
-        })
-        content_parts_for_llm.append({"type": "text", "text": f"[Attachment: {filename}]\n{text}"})
+    if len(files) > 1:
+        # Files are independent; extract them concurrently. map() keeps the original order.
+        results = list(_EXTRACT_POOL.map(lambda f: _process_one(f[0], f[1], f[2], max_chars), files))
+    else:
+        results = [_process_one(data, filename, content_type, max_chars) for data, filename, content_type in files]
+    for attachment, part in results:
+        attachments_for_db.append(attachment)
+        content_parts_for_llm.append(part)
 
     return attachments_for_db, content_parts_for_llm
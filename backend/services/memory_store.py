@@ -1,33 +1,42 @@
 """Should we store? Small model decides from last turn; insert into Memory only when appropriate."""
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import config
 from backend.models import db, Memory
-from backend.services.models_config import get_model_info, get_memory_extractor_model_id
-from backend.services.prompt_loader import load_prompt
+from backend.services.models_config import get_memory_extractor_model_id, smallest_available_model
+from backend.services.prompt_loader import render_prompt
 from backend.providers import base as providers_base
 
 _MIN_FACT_LENGTH = 10
+_NOTHING_RE = re.compile("NOTHING", re.IGNORECASE)
+_FIRST_PERSON_RE = re.compile(r"\b(i|i'm|im|my|me|mine|we|our)\b", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+# Context id -> ((mtime_ns, size), normalized float32 chunk embeddings) for context dedupe.
+# Persisted to config.CONTEXT_EMBEDDINGS_PATH and loaded on first use.
+_CONTEXT_VECS = {}
+_CONTEXT_VECS_LOADED = False
+# One worker: refreshes of _CONTEXT_VECS run one at a time, overlapped with the extraction LLM call.
+_CONTEXT_EMBED_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ctx-embed")
+# Phase 1 gathering (RAG retrieval, context file reads) runs here, concurrently.
+_GATHER_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mem-gather")
 
 
 def _pick_small_model():
     """Prefer GPT-5 Nano; fall back to smallest available model per provider from models.yaml."""
-    if get_model_info("openai/gpt-5-nano-2025-08-07"):
-        return "openai/gpt-5-nano-2025-08-07"
-    # Smallest per provider = last in each provider's list in models.yaml
-    from backend.services.models_config import get_models_list
-    by_provider = {}
-    for m in get_models_list():
-        if not m["available"]:
-            continue
-        by_provider[m["provider"]] = m["id"]
-    for mid in (by_provider.get("openai"), by_provider.get("anthropic"), by_provider.get("google")):
-        if mid and get_model_info(mid):
-            return mid
-    return None
+    return smallest_available_model(("openai", "anthropic", "google"), preferred="openai/gpt-5-nano-2025-08-07")
 
 
 def _build_existing_memories_text(user_content):
     """Return formatted text of relevant existing memories (RAG query)."""
     try:
-        from backend.services.rag import query as rag_query
+        from backend.services.rag import index_size, query as rag_query
+        if index_size() == 0:
+            return "No existing memories."
         hits = rag_query(user_content, top_k=8)
     except Exception:
         return "No existing memories."
@@ -56,23 +65,15 @@ def _build_existing_context_text(context_ids):
     return "\n".join(parts)
 
 
-def _get_all_contexts_text():
-    """Return formatted text of ALL human context files (for deduplication checking)."""
-    from backend.services.prompt_builder import list_contexts, _read_context
-    try:
-        all_contexts = list_contexts()
-        parts = []
-        for ctx in all_contexts:
-            parsed = _read_context(ctx["id"])
-            if not parsed:
-                continue
-            name, content = parsed
-            text = (content or "").strip()
-            if text:
-                parts.append(text)
-        return "\n".join(parts) if parts else ""
-    except Exception:
-        return ""
+def _likely_personal_fact(user_text):
+    """Cheap pre-filter: False for questions or turns with no first-person reference.
+
+    No length cut: short statements like "I'm vegan." are often the facts most worth keeping.
+    """
+    s = (user_text or "").strip()
+    if s.endswith("?"):
+        return False
+    return _FIRST_PERSON_RE.search(s) is not None
 
 
 def _is_obvious_non_fact(raw):
@@ -85,67 +86,127 @@ def _is_obvious_non_fact(raw):
     return False
 
 
-def _check_similarity_in_text(candidate_text, target_text, threshold=0.9):
-    """Check if candidate_text has similarity >= threshold to target_text using embeddings.
-    Returns True if similarity is high enough to consider it a duplicate."""
-    if not target_text or not candidate_text:
-        return False
-    try:
-        from backend.services.rag import _get_embed_fn
-        import numpy as np
-        embed_fn = _get_embed_fn()
-        candidate_vec = np.array(embed_fn([candidate_text])[0])
-        target_vec = np.array(embed_fn([target_text])[0])
-        # Compute cosine similarity
-        similarity = np.dot(candidate_vec, target_vec) / (np.linalg.norm(candidate_vec) * np.linalg.norm(target_vec))
-        return similarity >= threshold
-    except Exception:
-        # If embedding check fails, fall back to simple substring check for exact matches
-        candidate_lower = candidate_text.lower().strip()
-        target_lower = target_text.lower()
-        # Check if candidate appears verbatim in target (allowing for some whitespace differences)
-        if candidate_lower in target_lower:
-            return True
-        # Check if target appears verbatim in candidate
-        if target_lower in candidate_lower:
-            return True
-        return False
+def _context_matrix():
+    """Return normalized embeddings of every chunk of every context file stacked in one matrix, or None.
 
+    Chunks are split so long contexts are not truncated. Embeddings are cached per context
+    file until it changes; new or edited contexts are embedded together in one batch.
+    """
+    from backend.services.prompt_builder import list_contexts, _read_context
+    from backend.services.rag import chunk_text_for_embedding, embed_normalized
+    import numpy as np
+    if not _CONTEXT_VECS_LOADED:
+        _load_context_vecs()
+    live = set()
+    blocks = []
+    stale = []  # (ctx id, file signature, chunks) for contexts not cached yet
+    for ctx in list_contexts():
+        cid = ctx["id"]
+        try:
+            st = (config.CONTEXTS_DIR / f"{cid}.md").stat()
+        except OSError:
+            continue
+        sig = (st.st_mtime_ns, st.st_size)
+        live.add(cid)
+        cached = _CONTEXT_VECS.get(cid)
+        if cached is not None and cached[0] == sig:
+            blocks.append(cached[1])
+            continue
+        parsed = _read_context(cid)
+        text = (parsed[1] or "").strip() if parsed else ""
+        chunks = [c for c in chunk_text_for_embedding(text) if c.strip()] if text else []
+        stale.append((cid, sig, chunks))
+    removed = [cid for cid in _CONTEXT_VECS if cid not in live]
+    for cid in removed:
+        _CONTEXT_VECS.pop(cid, None)
 
-def _check_similarity_in_long_text(candidate_text, target_text, threshold=0.9):
-    """Check if candidate_text is similar to any chunk of target_text (for long context files).
-    Uses chunked embedding comparison so we don't truncate long contexts and miss duplicates."""
-    if not target_text or not candidate_text:
-        return False
+    new_chunks = [c for (_, _, chunks) in stale for c in chunks]
+    if new_chunks:
+        vecs = embed_normalized(new_chunks)
+        offset = 0
+        for cid, sig, chunks in stale:
+            block = vecs[offset:offset + len(chunks)]
+            offset += len(chunks)
+            _CONTEXT_VECS[cid] = (sig, block)
+            blocks.append(block)
+    else:
+        for cid, sig, _ in stale:
+            _CONTEXT_VECS[cid] = (sig, np.empty((0, 0), dtype=np.float32))
+    if stale or removed:
+        try:
+            _save_context_vecs()
+        except OSError as e:
+            print(f"Failed to save context embeddings: {e}")
+    blocks = [b for b in blocks if len(b)]
+    return np.vstack(blocks) if blocks else None
+
+
+def _load_context_vecs():
+    """Fill _CONTEXT_VECS from the on-disk sidecar, if it was written with the current embedding model."""
+    global _CONTEXT_VECS_LOADED
+    import numpy as np
+    _CONTEXT_VECS_LOADED = True
     try:
-        from backend.services.rag import chunk_text_for_embedding, _get_embed_fn
-        import numpy as np
-        chunks = chunk_text_for_embedding(target_text)
-        if not chunks:
-            return False
-        embed_fn = _get_embed_fn()
-        candidate_vec = np.array(embed_fn([candidate_text])[0])
-        norm_c = np.linalg.norm(candidate_vec)
-        if norm_c == 0:
-            return False
-        for chunk in chunks:
-            if not chunk.strip():
-                continue
-            chunk_vec = np.array(embed_fn([chunk])[0])
-            similarity = np.dot(candidate_vec, chunk_vec) / (norm_c * np.linalg.norm(chunk_vec))
-            if similarity >= threshold:
-                return True
+        with np.load(config.CONTEXT_EMBEDDINGS_PATH, allow_pickle=False) as data:
+            if str(data["model"]) != config.RAG_EMBEDDING_MODEL:
+                return
+            ids = data["ids"].tolist()
+            sigs = data["sigs"].tolist()
+            counts = data["counts"].tolist()
+            # Stored as float16 on disk; matmuls run in float32.
+            vecs = data["vecs"].astype(np.float32)
+    except (OSError, KeyError, ValueError):
+        return
+    offset = 0
+    for cid, (mtime_ns, size), n in zip(ids, sigs, counts):
+        _CONTEXT_VECS[cid] = ((mtime_ns, size), vecs[offset:offset + n])
+        offset += n
+
+
+def _save_context_vecs():
+    """Write _CONTEXT_VECS to the sidecar .npz (atomically) so a restart does not re-embed every context."""
+    import numpy as np
+    ids = list(_CONTEXT_VECS)
+    entries = [_CONTEXT_VECS[cid] for cid in ids]
+    nonempty = [block for (_, block) in entries if len(block)]
+    path = config.CONTEXT_EMBEDDINGS_PATH
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            model=np.array(config.RAG_EMBEDDING_MODEL),
+            ids=np.array(ids, dtype=str),
+            sigs=np.array([sig for (sig, _) in entries], dtype=np.int64).reshape(-1, 2),
+            counts=np.array([len(block) for (_, block) in entries], dtype=np.int64),
+            vecs=(np.vstack(nonempty) if nonempty else np.empty((0, 0))).astype(np.float16),
+        )
+    os.replace(tmp, path)
+
+
+def _context_duplicate(candidate_vec, context_matrix, threshold=0.9):
+    """True if normalized candidate_vec is similar to any context chunk in context_matrix (one matmul)."""
+    if context_matrix is None:
         return False
-    except Exception:
-        candidate_lower = candidate_text.lower().strip()
-        target_lower = target_text.lower()
-        if candidate_lower in target_lower or target_lower in candidate_lower:
+    return float((context_matrix @ candidate_vec).max()) >= threshold
+
+
+def _context_contains_text(candidate_text):
+    """Fallback when embeddings are unavailable: verbatim containment either way against any context."""
+    from backend.services.prompt_builder import list_contexts, _read_context
+    candidate_lower = candidate_text.lower().strip()
+    for ctx in list_contexts():
+        parsed = _read_context(ctx["id"])
+        target_lower = ((parsed[1] if parsed else "") or "").strip().lower()
+        if target_lower and (candidate_lower in target_lower or target_lower in candidate_lower):
             return True
-        return False
+    return False
 
 
 def extract_and_store(user_content, assistant_content, app, context_ids=None):
     """Run in background: ask small model if there is a fact worth storing; if yes and not duplicate, insert Memory."""
+    if config.MEMORY_PREFILTER and not _likely_personal_fact(user_content):
+        logger.debug("Memory extraction skipped by prefilter (%d-char user turn)", len(user_content or ""))
+        return
     model_id = get_memory_extractor_model_id() or _pick_small_model()
     if not model_id:
         return
@@ -153,22 +214,30 @@ def extract_and_store(user_content, assistant_content, app, context_ids=None):
     # Phase 1: Data gathering (full content; no truncation)
     user_text = (user_content or "")
     assistant_text = (assistant_content or "")
-    existing_memories_text = _build_existing_memories_text(user_content or "")
-    existing_context_text = _build_existing_context_text(context_ids or [])
+    memories_future = _GATHER_POOL.submit(_build_existing_memories_text, user_content or "")
+    context_future = _GATHER_POOL.submit(_build_existing_context_text, context_ids or [])
 
     # Phase 2: Build prompt from template
-    template = load_prompt("memory_extraction")
-    if not template:
-        return
+    existing_memories_text = memories_future.result()
+    existing_context_text = context_future.result()
     existing_context_block = ""
     if existing_context_text:
         existing_context_block = (
             "\n\nExisting context (do not duplicate - this information is already available every time):\n"
             + existing_context_text
         )
-    system_content = template.replace("{{EXISTING_MEMORIES}}", existing_memories_text).replace(
-        "{{EXISTING_CONTEXT}}", existing_context_block
-    ).replace("{{USER_TEXT}}", user_text).replace("{{ASSISTANT_TEXT}}", assistant_text)
+    subs = {
+        "EXISTING_MEMORIES": existing_memories_text,
+        "EXISTING_CONTEXT": existing_context_block,
+        "USER_TEXT": user_text,
+        "ASSISTANT_TEXT": assistant_text,
+    }
+    system_content = render_prompt("memory_extraction", subs)
+    if not system_content:
+        return
+
+    # Embed any new or edited context files while the small model is deciding.
+    context_warmup = _CONTEXT_EMBED_POOL.submit(_context_matrix)
 
     messages = [
         {"role": "system", "content": system_content},
@@ -176,7 +245,20 @@ def extract_and_store(user_content, assistant_content, app, context_ids=None):
     ]
     try:
         with app.app_context():
-            parts = list(providers_base.generate(messages, model_id, stream=True))
+            # Any NOTHING in the reply rejects it, so stop streaming as soon as one appears.
+            # The last 6 chars carry over so a sentinel split across chunks is still caught.
+            parts = []
+            tail = ""
+            gen = providers_base.generate(messages, model_id, stream=True)
+            try:
+                for tok in gen:
+                    scan = tail + tok
+                    if _NOTHING_RE.search(scan):
+                        return
+                    parts.append(tok)
+                    tail = scan[-6:]
+            finally:
+                gen.close()
             raw = "".join(parts).strip()
 
             # Phase 3: Response parsing (plain-text)
@@ -184,19 +266,29 @@ def extract_and_store(user_content, assistant_content, app, context_ids=None):
                 return
             if len(raw) < _MIN_FACT_LENGTH:
                 return
-            if "NOTHING" in raw.upper():
-                return
             if _is_obvious_non_fact(raw):
                 return
 
             candidate_fact = raw.strip()
 
             # Phase 4: Dedupe check — skip if candidate is too similar to existing memories or appears in ANY context
+            # The candidate is embedded once and the vector reused for both checks.
+            try:
+                from backend.services.rag import embed_normalized
+                candidate_vec = embed_normalized([candidate_fact])[0]
+            except Exception:
+                candidate_vec = None
+
             # Check 1: Similarity to existing memories (similarity > 0.9)
             # top_k=5 is sufficient since duplicates with >0.9 similarity will be at the top of results
             try:
-                from backend.services.rag import query as rag_query
-                dup_hits = rag_query(candidate_fact, top_k=5, min_similarity=0.90)
+                from backend.services.rag import index_size, query as rag_query, query_by_embedding
+                if index_size() == 0:
+                    dup_hits = []
+                elif candidate_vec is not None:
+                    dup_hits = query_by_embedding(candidate_vec, top_k=5, min_similarity=0.90)
+                else:
+                    dup_hits = rag_query(candidate_fact, top_k=5, min_similarity=0.90)
                 if dup_hits:
                     return  # treat as duplicate, do not save
             except Exception:
@@ -204,16 +296,14 @@ def extract_and_store(user_content, assistant_content, app, context_ids=None):
 
             # Check 2: Check if candidate appears in ANY context (not just current ones) - chunked comparison for long contexts
             try:
-                from backend.services.prompt_builder import list_contexts, _read_context
-                all_contexts = list_contexts()
-                for ctx in all_contexts:
-                    parsed = _read_context(ctx["id"])
-                    if not parsed:
-                        continue
-                    name, content = parsed
-                    text = (content or "").strip()
-                    if text and _check_similarity_in_long_text(candidate_fact, text, threshold=0.9):
-                        return  # duplicate found in a context file
+                try:
+                    if candidate_vec is None:
+                        raise RuntimeError("candidate embedding unavailable")
+                    duplicate = _context_duplicate(candidate_vec, context_warmup.result(), threshold=0.9)
+                except Exception:
+                    duplicate = _context_contains_text(candidate_fact)
+                if duplicate:
+                    return  # duplicate found in a context file
             except Exception:
                 pass
 
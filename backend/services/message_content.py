@@ -1,11 +1,23 @@
 """Build LLM message content from a Message (text or multimodal from attachments)."""
+from functools import lru_cache
 
+_IMAGE = "image"
+_TEXT = "text"
+_IMAGE_MIME_BY_EXT = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "gif": "image/gif",
+}
 
+
+@lru_cache(maxsize=1024)
 def _mime_from_filename(filename: str) -> str:
-    if not filename or "." not in filename:
+    _, dot, ext = (filename or "").rpartition(".")
+    if not dot:
         return "image/png"
-    ext = "." + filename.rsplit(".", 1)[-1].lower()
-    return {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp", ".gif": "image/gif"}.get(ext, "image/png")
+    return _IMAGE_MIME_BY_EXT.get(ext.lower(), "image/png")
 
 
 def message_to_llm_content(msg) -> str | list[dict]:
@@ -20,21 +32,24 @@ def message_to_llm_content(msg) -> str | list[dict]:
     parts = []
     # 1. User's typed text
     if msg.content and msg.content.strip():
-        parts.append({"type": "text", "text": msg.content})
+        parts.append({"type": _TEXT, "text": msg.content})
 
     # 2. Each attachment
     for att in attachments:
-        atype = att.get("type") or "text"
-        filename = att.get("filename") or "file"
-        if atype == "image" and att.get("image_data"):
-            mime = _mime_from_filename(filename)
-            url = f"data:{mime};base64,{att['image_data']}"
-            parts.append({"type": "image_url", "image_url": {"url": url}})
-        elif atype == "text" and att.get("extracted_text"):
-            parts.append({"type": "text", "text": f"[Attachment: {filename}]\n{att['extracted_text']}"})
+        get = att.get
+        atype = get("type") or _TEXT
+        if atype == _IMAGE:
+            image_data = get("image_data")
+            if image_data:
+                mime = _mime_from_filename(get("filename") or "file")
+                parts.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_data}"}})
+        elif atype == _TEXT:
+            extracted = get("extracted_text")
+            if extracted:
+                parts.append({"type": _TEXT, "text": f"[Attachment: {get('filename') or 'file'}]\n{extracted}"})
 
     if not parts:
         return msg.content or ""
-    if len(parts) == 1 and parts[0].get("type") == "text":
-        return parts[0].get("text", "")
+    if len(parts) == 1 and parts[0]["type"] == _TEXT:
+        return parts[0]["text"]
     return parts
@@ -1,6 +1,9 @@
 """Model catalog utilities with provider-fetched models and YAML fallback."""
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
-from threading import Lock
+import re
+from threading import Lock, Thread
 import time
 
 import yaml
@@ -13,6 +16,15 @@ _PROVIDERS = ("openai", "anthropic", "google")
 _PROVIDER_CACHE_TTL_SECONDS = 300
 _PROVIDER_MODELS_CACHE = {}
 _PROVIDER_CACHE_LOCK = Lock()
+# Parsed models.yaml, re-read only when (mtime_ns, size) changes on disk.
+_YAML_CACHE = {"mtime": None, "size": None, "data": {}}
+_YAML_CACHE_LOCK = Lock()
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# provider -> bool(API key set); short TTL since keys can also change via env or settings.json edits.
+_KEY_FLAGS_TTL_SECONDS = 10
+_KEY_FLAGS_CACHE = {"expires_at": 0.0, "flags": None}
+# {id: entry} index, rebuilt when models.yaml changes or the provider cache TTL window rolls over.
+_LOOKUP_CACHE = {"key": None, "index": None}
 
 _OPENAI_CHAT_PREFIXES = ("gpt", "chatgpt", "o1", "o3", "o4")
 _OPENAI_NON_CHAT_TOKENS = (
@@ -28,24 +40,40 @@ _OPENAI_NON_CHAT_TOKENS = (
     "realtime",
 )
 _GOOGLE_NON_CHAT_TOKENS = ("embedding", "imagen", "veo", "tts", "asr")
+_OPENAI_NON_CHAT_RE = re.compile("|".join(map(re.escape, _OPENAI_NON_CHAT_TOKENS)))
+_GOOGLE_NON_CHAT_RE = re.compile("|".join(map(re.escape, _GOOGLE_NON_CHAT_TOKENS)))
 
 
 def invalidate_models_cache():
     """Clear cached provider model lists."""
     with _PROVIDER_CACHE_LOCK:
         _PROVIDER_MODELS_CACHE.clear()
+        _LOOKUP_CACHE.update(key=None, index=None)
+        _KEY_FLAGS_CACHE.update(expires_at=0.0, flags=None)
 
 
 def _load_yaml():
-    if not _CONFIG_PATH.exists():
+    """Return parsed models.yaml. The result is shared; copy before mutating."""
+    try:
+        st = _CONFIG_PATH.stat()
+    except OSError:
         return {}
-    with open(_CONFIG_PATH, encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
+    with _YAML_CACHE_LOCK:
+        if _YAML_CACHE["mtime"] == st.st_mtime_ns and _YAML_CACHE["size"] == st.st_size:
+            return _YAML_CACHE["data"]
+        with open(_CONFIG_PATH, encoding="utf-8") as f:
+            data = yaml.load(f, Loader=_YamlLoader) or {}
+        _YAML_CACHE.update(mtime=st.st_mtime_ns, size=st.st_size, data=data)
+        return data
 
 
 def _write_yaml(data):
-    with open(_CONFIG_PATH, "w", encoding="utf-8") as f:
-        yaml.safe_dump(data, f, sort_keys=False, default_flow_style=False, allow_unicode=True)
+    with _YAML_CACHE_LOCK:
+        with open(_CONFIG_PATH, "w", encoding="utf-8") as f:
+            yaml.safe_dump(data, f, sort_keys=False, default_flow_style=False, allow_unicode=True)
+        # Seed the cache with what was just written so the next read does not re-parse it.
+        st = _CONFIG_PATH.stat()
+        _YAML_CACHE.update(mtime=st.st_mtime_ns, size=st.st_size, data=data)
 
 
 def _fetch_provider_models(provider):
@@ -89,9 +117,26 @@ def _get_cached_provider_models(provider, force_refresh=False):
     return list(models or [])
 
 
+def prewarm_provider_models():
+    """Fetch every keyed provider's model list concurrently in the background, so the first request hits the cache."""
+    def _fetch(provider):
+        try:
+            _get_cached_provider_models(provider)
+        except Exception as e:
+            print(f"Model list prewarm failed for {provider}: {e}")
+
+    def _run():
+        providers = [p for p, has_key in _provider_key_flags().items() if has_key]
+        if not providers:
+            return
+        with ThreadPoolExecutor(max_workers=len(providers), thread_name_prefix="models-prewarm") as pool:
+            list(pool.map(_fetch, providers))
+
+    Thread(target=_run, name="models-prewarm", daemon=True).start()
+
+
 def _normalize_provider_entries(provider, raw_models):
-    out = []
-    seen = set()
+    by_id = {}
     for item in raw_models or []:
         model = ""
         name = ""
@@ -113,20 +158,16 @@ def _normalize_provider_entries(provider, raw_models):
         if not model:
             continue
         entry_id = f"{provider}/{model}"
-        if entry_id in seen:
+        if entry_id in by_id:
             continue
-        seen.add(entry_id)
-        out.append(
-            {
-                "id": entry_id,
-                "name": name or model,
-                "provider": provider,
-                "model": model,
-                "meta": meta,
-            }
-        )
-    out.sort(key=lambda x: x["model"])
-    return out
+        by_id[entry_id] = {
+            "id": entry_id,
+            "name": name or model,
+            "provider": provider,
+            "model": model,
+            "meta": meta,
+        }
+    return sorted(by_id.values(), key=itemgetter("model"))
 
 
 def _yaml_provider_entries(data, provider):
@@ -170,7 +211,7 @@ def _is_chat_capable(provider, entry):
     if provider == "openai":
         if not model:
             return False
-        if any(token in model for token in _OPENAI_NON_CHAT_TOKENS):
+        if _OPENAI_NON_CHAT_RE.search(model):
             return False
         return model.startswith(_OPENAI_CHAT_PREFIXES)
 
@@ -181,15 +222,26 @@ def _is_chat_capable(provider, entry):
         actions = meta.get("supported_actions") or meta.get("supportedActions") or []
         if actions:
             return _has_google_generate_content(actions)
-        if any(token in model for token in _GOOGLE_NON_CHAT_TOKENS):
+        if _GOOGLE_NON_CHAT_RE.search(model):
             return False
         return model.startswith("gemini") or "gemini" in model
 
     return False
 
 
+def _provider_key_flags():
+    now = time.monotonic()
+    with _PROVIDER_CACHE_LOCK:
+        if _KEY_FLAGS_CACHE["flags"] is not None and _KEY_FLAGS_CACHE["expires_at"] > now:
+            return _KEY_FLAGS_CACHE["flags"]
+    flags = {provider: bool(get_api_key(provider)) for provider in _PROVIDERS}
+    with _PROVIDER_CACHE_LOCK:
+        _KEY_FLAGS_CACHE.update(expires_at=now + _KEY_FLAGS_TTL_SECONDS, flags=flags)
+    return flags
+
+
 def _build_provider_catalog(provider, data, force_refresh=False):
-    available = bool(get_api_key(provider))
+    available = _provider_key_flags().get(provider, False)
     yaml_entries = [
         entry for entry in _yaml_provider_entries(data, provider) if _is_chat_capable(provider, entry)
     ]
@@ -221,8 +273,19 @@ def _build_provider_catalog(provider, data, force_refresh=False):
     }
 
 
+def _lookup_cache_key():
+    with _YAML_CACHE_LOCK:
+        yaml_key = (_YAML_CACHE["mtime"], _YAML_CACHE["size"])
+    return yaml_key, int(time.monotonic() // _PROVIDER_CACHE_TTL_SECONDS)
+
+
 def _build_lookup_index(force_refresh=False):
     data = _load_yaml()
+    key = _lookup_cache_key()
+    if not force_refresh:
+        with _PROVIDER_CACHE_LOCK:
+            if _LOOKUP_CACHE["key"] == key:
+                return _LOOKUP_CACHE["index"]
     out = {}
     for provider in _PROVIDERS:
         catalog = _build_provider_catalog(provider, data, force_refresh=force_refresh)
@@ -234,6 +297,8 @@ def _build_lookup_index(force_refresh=False):
                     "model": entry["model"],
                     "available": available,
                 }
+    with _PROVIDER_CACHE_LOCK:
+        _LOOKUP_CACHE.update(key=key, index=out)
     return out
 
 
@@ -290,6 +355,28 @@ def get_memory_extractor_model_id():
     return None
 
 
+def smallest_available_model(providers=_PROVIDERS, preferred=None):
+    """Return preferred if available, else the smallest available model of the first matching provider, or None.
+
+    Smallest = last entry in the provider's list in models.yaml (read directly, no catalog build).
+    """
+    # One lookup index for every candidate instead of a get_model_info() call each.
+    lookup = _build_lookup_index()
+
+    def usable(model_id):
+        entry = lookup.get(model_id)
+        return bool(entry and entry["available"])
+
+    if preferred and usable(preferred):
+        return preferred
+    data = _load_yaml()
+    for provider in providers:
+        entries = _yaml_provider_entries(data, provider)
+        if entries and usable(entries[-1]["id"]):
+            return entries[-1]["id"]
+    return None
+
+
 def get_default_model_id():
     """Return the default model id from models.yaml, or None."""
     data = _load_yaml()
@@ -299,7 +386,7 @@ def get_default_model_id():
 def set_default_model(model_id):
     """Update the default model in models.yaml. model_id must match a known model id (or None to clear)."""
     model_id = (model_id or "").strip() or None
-    data = _load_yaml()
+    data = dict(_load_yaml())
     if model_id is not None:
         valid_ids = set(_build_lookup_index().keys())
         if model_id not in valid_ids:
@@ -1,6 +1,9 @@
 """Build system message from base prompt, rules + human context files. Skip missing."""
+import os
 import re
+import time
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Set, Tuple, Any
 from zoneinfo import ZoneInfo
@@ -8,29 +11,49 @@ from zoneinfo import ZoneInfo
 import yaml
 
 import config
-from backend.services.prompt_loader import load_prompt
+from backend.services.prompt_loader import load_prompt, read_utf8
 from backend.services.web_search_mode import (
     WEB_SEARCH_MODE_OFF,
     mode_from_legacy_enabled,
     parse_web_search_mode,
 )
 
+# libyaml's C loader when PyYAML was built with it; same safe semantics, much faster.
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_FRONTMATTER_MAX_CHARS = 8192
+# Same phrases the RAG query expansion used to test one by one on the lowercased message.
+_FIRST_PERSON_RE = re.compile(r" i | my | me |am i|do i|what's my|what is my", re.IGNORECASE)
+_BASE_PLACEHOLDER_RE = re.compile(r"\{\{(DATE|DAY|TIME|USER_NAME)\}\}")
+
+_SECTION_RE = re.compile(r"^##\s+(Task|Success\s+Criteria|Guidelines)\s*$", re.IGNORECASE | re.MULTILINE)
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$", re.MULTILINE)
+_RULE_ID_RE = re.compile(r"@([a-zA-Z0-9_-]+)")
+_ID_VALID_RE = re.compile(r"^[a-zA-Z0-9_-]+$")
+_CMD_ALPHA_RE = re.compile(r"^/([a-zA-Z]+)\s*(.*)$", re.DOTALL)
+_CMD_ID_RE = re.compile(r"^/([a-zA-Z0-9_-]+)\s*(.*)$", re.DOTALL)
+
 
 def _read_base_system_prompt():
     """Read base system prompt from prompts/system.md; substitute {{DATE}}, {{DAY}}, {{TIME}}, {{USER_NAME}}."""
     text = load_prompt("system")
     if not text:
         text = "# Role\n\nYou are a personal assistant. Use the Rules, Context, and Relevant memory sections below when provided."
-    now = datetime.now()
+    user_name = config.USER_NAME if config.USER_NAME else "the user"
+    return _substitute_base_prompt(text, int(time.time() // 60), user_name)
+
+
+@lru_cache(maxsize=4)
+def _substitute_base_prompt(text, minute_bucket, user_name):
+    """Fill the date/time placeholders; cached per minute since {{TIME}} has minute resolution."""
+    now = datetime.fromtimestamp(minute_bucket * 60)
     today = now.strftime("%A, %B %d, %Y")
     day_of_week = now.strftime("%A")
     now_est = now.astimezone(ZoneInfo("America/New_York"))
     time_of_day = now_est.strftime("%I:%M %p %Z")  # EST or EDT
     if time_of_day[0] == "0":
         time_of_day = time_of_day[1:]  # "2:30 PM EST" not "02:30 PM EST"
-    user_name = config.USER_NAME if config.USER_NAME else "the user"
-    text = text.replace("{{DATE}}", today).replace("{{DAY}}", day_of_week).replace("{{TIME}}", time_of_day).replace("{{USER_NAME}}", user_name)
-    return text
+    subs = {"DATE": today, "DAY": day_of_week, "TIME": time_of_day, "USER_NAME": user_name}
+    return _BASE_PLACEHOLDER_RE.sub(lambda m: subs[m.group(1)], text)
 
 
 class Rule:
@@ -70,6 +93,7 @@ class Command:
         self.web_search_mode = web_search_mode
         self.web_search_mode_explicit = web_search_mode_explicit
         self.web_search_enabled = web_search_enabled
+        self.rule_refs: Set[str] = set()  # rule ids the body @mentions; filled at load time
 
 
 def _parse_command_sections(body: str) -> Dict[str, str]:
@@ -82,11 +106,7 @@ def _parse_command_sections(body: str) -> Dict[str, str]:
         return out
     text = body.strip()
     # Match ## Task, ## Success Criteria, ## Guidelines (case-insensitive for header)
-    section_pattern = re.compile(
-        r"^##\s+(Task|Success\s+Criteria|Guidelines)\s*$",
-        re.IGNORECASE | re.MULTILINE,
-    )
-    matches = list(section_pattern.finditer(text))
+    matches = list(_SECTION_RE.finditer(text))
     if not matches:
         out["task"] = text
         return out
@@ -109,8 +129,15 @@ def _parse_command_sections(body: str) -> Dict[str, str]:
 
 _RULES_CACHE: Dict[str, Rule] = {}
 _COMMANDS_CACHE: Dict[str, Command] = {}
-_RULES_MTIME: float = 0.0
-_COMMANDS_MTIME: float = 0.0
+# Directory signatures the caches were built from; None forces a reload.
+_RULES_SIG: Optional[Tuple[Tuple[str, int, int], ...]] = None
+_COMMANDS_SIG: Optional[Tuple[Tuple[str, int, int], ...]] = None
+# File name -> (mtime_ns, size, parsed object or None); only changed files are re-parsed on reload.
+_RULE_FILES: Dict[str, Tuple[int, int, Optional[Rule]]] = {}
+_COMMAND_FILES: Dict[str, Tuple[int, int, Optional[Command]]] = {}
+# Rule id -> rule ids its body @mentions; rebuilt with _RULES_CACHE.
+_RULES_DEPS: Dict[str, Set[str]] = {}
+_RULES_ALWAYS_ON_IDS: frozenset = frozenset()
 
 
 def _split_frontmatter(text: str) -> Tuple[Optional[dict], str]:
@@ -127,29 +154,51 @@ def _split_frontmatter(text: str) -> Tuple[Optional[dict], str]:
     except ValueError:
         return None, text
     fm_and_rest = fm_and_rest.lstrip("\n")
-    if "\n---" not in fm_and_rest:
+    # Frontmatter is a few lines; don't scan a large body for the closing delimiter.
+    end_idx = fm_and_rest.find("\n---", 0, _FRONTMATTER_MAX_CHARS)
+    if end_idx == -1:
         return None, text
-    header, _, body = fm_and_rest.partition("\n---")
+    header = fm_and_rest[:end_idx]
+    body = fm_and_rest[end_idx + 4:]
     try:
-        meta = yaml.safe_load(header) or {}
+        meta = yaml.load(header, Loader=_YAML_LOADER) or {}
     except Exception as e:
         print(f"Failed to parse rule/command frontmatter: {e}")
         return None, text
     return meta, body.lstrip().lstrip("\n")
 
 
-def _collect_dir_mtime(dir_path: Path) -> float:
-    latest = 0.0
-    if not dir_path.exists():
-        return latest
-    for p in dir_path.glob("*.md"):
-        try:
-            mtime = p.stat().st_mtime
-        except OSError:
-            continue
-        if mtime > latest:
-            latest = mtime
-    return latest
+def _dir_signature(dir_path: Path) -> Tuple[Tuple[str, int, int], ...]:
+    """Return sorted (name, mtime_ns, size) for each *.md file; changes on edit, add or delete."""
+    entries = []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if not entry.name.endswith(".md"):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.name, st.st_mtime_ns, st.st_size))
+    except OSError:
+        return ()
+    entries.sort()
+    return tuple(entries)
+
+
+def invalidate_rules() -> None:
+    """Force the next load_rules() to re-read the rules directory."""
+    global _RULES_SIG
+    _RULES_SIG = None
+
+
+def invalidate_commands() -> None:
+    """Force the next load_commands() to re-read the commands directory."""
+    global _COMMANDS_SIG
+    _COMMANDS_SIG = None
 
 
 def _demote_markdown_headings(text: str, levels: int = 1) -> str:
@@ -167,140 +216,212 @@ def _demote_markdown_headings(text: str, levels: int = 1) -> str:
         new_level = min(len(hashes) + levels, 6)
         return "#" * new_level + " " + rest
 
-    return re.sub(r"^(#{1,6})\s+(.*)$", _repl, text, flags=re.MULTILINE)
+    return _HEADING_RE.sub(_repl, text)
+
+
+def _parse_rule_file(path: Path) -> Optional[Rule]:
+    """Parse one rule file. Returns None for an invalid id; read errors propagate."""
+    raw = read_utf8(path)
+    meta, body = _split_frontmatter(raw)
+    stem = path.stem
+    rid = stem
+    name = stem
+    always_on = False
+    tags: List[str] = []
+    if meta:
+        rid = str(meta.get("id") or rid)
+        name = str(meta.get("name") or name)
+        # Support both new always_on and legacy scope/enabled keys.
+        if "always_on" in meta:
+            always_on = bool(meta.get("always_on"))
+        else:
+            scope = str(meta.get("scope") or "optional")
+            enabled = bool(meta.get("enabled", True))
+            always_on = enabled and (scope == "global")
+        mtags = meta.get("tags") or []
+        if isinstance(mtags, list):
+            tags = [str(t) for t in mtags]
+    if not _ID_VALID_RE.match(rid):
+        print(f"Skipping rule with invalid id {rid!r} in {path}")
+        return None
+    return Rule(rid, name, always_on, tags, body.strip())
+
+
+def _parse_command_file(path: Path) -> Optional[Command]:
+    """Parse one command file. Returns None for an invalid id; read errors propagate."""
+    raw = read_utf8(path)
+    meta, body = _split_frontmatter(raw)
+    stem = path.stem
+    cid = stem
+    name = stem
+    description = ""
+    tags: List[str] = []
+    context_ids: List[str] = []
+    web_search_mode = WEB_SEARCH_MODE_OFF
+    web_search_mode_explicit = False
+    web_search_enabled = False
+    if meta:
+        cid = str(meta.get("id") or cid)
+        name = str(meta.get("name") or name)
+        description = str(meta.get("description") or description)
+        mtags = meta.get("tags") or []
+        if isinstance(mtags, list):
+            tags = [str(t) for t in mtags]
+        ctx_ids = meta.get("context_ids") or []
+        if isinstance(ctx_ids, list):
+            context_ids = [str(x) for x in ctx_ids if x]
+        explicit_mode = parse_web_search_mode(meta.get("web_search_mode"))
+        if explicit_mode is not None:
+            web_search_mode = explicit_mode
+            web_search_mode_explicit = True
+            web_search_enabled = explicit_mode != WEB_SEARCH_MODE_OFF
+        else:
+            web_search_enabled = bool(meta.get("web_search_enabled", meta.get("web_search", False)))
+            web_search_mode = mode_from_legacy_enabled(web_search_enabled)
+            web_search_mode_explicit = False
+    if not _ID_VALID_RE.match(cid):
+        print(f"Skipping command with invalid id {cid!r} in {path}")
+        return None
+    body_stripped = body.strip()
+    sections = _parse_command_sections(body_stripped)
+    cmd = Command(
+        cid,
+        name,
+        description,
+        tags,
+        body_stripped,
+        task=sections.get("task") or None,
+        success_criteria=sections.get("success_criteria") or None,
+        guidelines=sections.get("guidelines") or None,
+        context_ids=context_ids,
+        web_search_mode=web_search_mode,
+        web_search_mode_explicit=web_search_mode_explicit,
+        web_search_enabled=web_search_enabled,
+    )
+    cmd.rule_refs = _extract_rule_ids_from_text(body_stripped)
+    return cmd
+
+
+def _load_dir_incremental(dir_path: Path, sig, file_cache: Dict[str, tuple], parse, kind: str) -> Tuple[Dict[str, Any], Dict[str, tuple]]:
+    """Build {id: obj} for the files in sig, re-parsing only files whose (mtime_ns, size) changed.
+    Returns (items, new file cache); files that failed to read are left out of the cache so they are retried."""
+    items: Dict[str, Any] = {}
+    new_cache: Dict[str, tuple] = {}
+    for fname, mtime_ns, size in sig:
+        cached = file_cache.get(fname)
+        if cached is not None and cached[0] == mtime_ns and cached[1] == size:
+            obj = cached[2]
+        else:
+            path = dir_path / fname
+            try:
+                obj = parse(path)
+            except Exception as e:
+                print(f"Failed to read {kind} file {path}: {e}")
+                continue
+        new_cache[fname] = (mtime_ns, size, obj)
+        if obj is None:
+            continue
+        if obj.id in items:
+            print(f"Duplicate {kind} id {obj.id!r} in {dir_path / fname}; skipping")
+            continue
+        items[obj.id] = obj
+    return items, new_cache
 
 
 def load_rules() -> Dict[str, Rule]:
-    """Load rules from DATA_DIR/rules with simple mtime-based caching."""
-    global _RULES_CACHE, _RULES_MTIME
-    mtime = _collect_dir_mtime(config.RULES_DIR)
-    if mtime <= _RULES_MTIME and _RULES_CACHE:
+    """Load rules from DATA_DIR/rules; cached until a file is added, removed or modified."""
+    global _RULES_CACHE, _RULES_SIG, _RULE_FILES, _RULES_DEPS, _RULES_ALWAYS_ON_IDS
+    sig = _dir_signature(config.RULES_DIR)
+    if sig == _RULES_SIG:
         return _RULES_CACHE
-    rules: Dict[str, Rule] = {}
-    if config.RULES_DIR.exists():
-        for path in config.RULES_DIR.glob("*.md"):
-            try:
-                raw = path.read_text(encoding="utf-8")
-            except Exception as e:
-                print(f"Failed to read rule file {path}: {e}")
-                continue
-            meta, body = _split_frontmatter(raw)
-            stem = path.stem
-            rid = stem
-            name = stem
-            always_on = False
-            tags: List[str] = []
-            if meta:
-                rid = str(meta.get("id") or rid)
-                name = str(meta.get("name") or name)
-                # Support both new always_on and legacy scope/enabled keys.
-                if "always_on" in meta:
-                    always_on = bool(meta.get("always_on"))
-                else:
-                    scope = str(meta.get("scope") or "optional")
-                    enabled = bool(meta.get("enabled", True))
-                    always_on = enabled and (scope == "global")
-                mtags = meta.get("tags") or []
-                if isinstance(mtags, list):
-                    tags = [str(t) for t in mtags]
-            if not re.match(r"^[a-zA-Z0-9_-]+$", rid):
-                print(f"Skipping rule with invalid id {rid!r} in {path}")
-                continue
-            if rid in rules:
-                print(f"Duplicate rule id {rid!r} in {path}; skipping")
-                continue
-            rules[rid] = Rule(rid, name, always_on, tags, body.strip())
+    rules, _RULE_FILES = _load_dir_incremental(config.RULES_DIR, sig, _RULE_FILES, _parse_rule_file, "rule")
+    _RULES_DEPS = {rid: _extract_rule_ids_from_text(r.body) for rid, r in rules.items()}
+    _RULES_ALWAYS_ON_IDS = frozenset(rid for rid, r in rules.items() if r.always_on)
     _RULES_CACHE = rules
-    _RULES_MTIME = mtime
+    _RULES_SIG = sig
     return rules
 
 
 def load_commands() -> Dict[str, Command]:
-    """Load commands from DATA_DIR/commands with simple mtime-based caching."""
-    global _COMMANDS_CACHE, _COMMANDS_MTIME
-    mtime = _collect_dir_mtime(config.COMMANDS_DIR)
-    if mtime <= _COMMANDS_MTIME and _COMMANDS_CACHE:
+    """Load commands from DATA_DIR/commands; cached until a file is added, removed or modified."""
+    global _COMMANDS_CACHE, _COMMANDS_SIG, _COMMAND_FILES
+    sig = _dir_signature(config.COMMANDS_DIR)
+    if sig == _COMMANDS_SIG:
         return _COMMANDS_CACHE
-    cmds: Dict[str, Command] = {}
-    if config.COMMANDS_DIR.exists():
-        for path in config.COMMANDS_DIR.glob("*.md"):
-            try:
-                raw = path.read_text(encoding="utf-8")
-            except Exception as e:
-                print(f"Failed to read command file {path}: {e}")
-                continue
-            meta, body = _split_frontmatter(raw)
-            stem = path.stem
-            cid = stem
-            name = stem
-            description = ""
-            tags: List[str] = []
-            context_ids: List[str] = []
-            web_search_mode = WEB_SEARCH_MODE_OFF
-            web_search_mode_explicit = False
-            web_search_enabled = False
-            if meta:
-                cid = str(meta.get("id") or cid)
-                name = str(meta.get("name") or name)
-                description = str(meta.get("description") or description)
-                mtags = meta.get("tags") or []
-                if isinstance(mtags, list):
-                    tags = [str(t) for t in mtags]
-                ctx_ids = meta.get("context_ids") or []
-                if isinstance(ctx_ids, list):
-                    context_ids = [str(x) for x in ctx_ids if x]
-                explicit_mode = parse_web_search_mode(meta.get("web_search_mode"))
-                if explicit_mode is not None:
-                    web_search_mode = explicit_mode
-                    web_search_mode_explicit = True
-                    web_search_enabled = explicit_mode != WEB_SEARCH_MODE_OFF
-                else:
-                    web_search_enabled = bool(meta.get("web_search_enabled", meta.get("web_search", False)))
-                    web_search_mode = mode_from_legacy_enabled(web_search_enabled)
-                    web_search_mode_explicit = False
-            if not re.match(r"^[a-zA-Z0-9_-]+$", cid):
-                print(f"Skipping command with invalid id {cid!r} in {path}")
-                continue
-            if cid in cmds:
-                print(f"Duplicate command id {cid!r} in {path}; skipping")
-                continue
-            body_stripped = body.strip()
-            sections = _parse_command_sections(body_stripped)
-            cmds[cid] = Command(
-                cid,
-                name,
-                description,
-                tags,
-                body_stripped,
-                task=sections.get("task") or None,
-                success_criteria=sections.get("success_criteria") or None,
-                guidelines=sections.get("guidelines") or None,
-                context_ids=context_ids,
-                web_search_mode=web_search_mode,
-                web_search_mode_explicit=web_search_mode_explicit,
-                web_search_enabled=web_search_enabled,
-            )
+    cmds, _COMMAND_FILES = _load_dir_incremental(
+        config.COMMANDS_DIR, sig, _COMMAND_FILES, _parse_command_file, "command"
+    )
     _COMMANDS_CACHE = cmds
-    _COMMANDS_MTIME = mtime
+    _COMMANDS_SIG = sig
     return cmds
 
 
+def get_command_by_id(command_id: Optional[str]) -> Optional[Command]:
+    """Return one command from the cached load_commands() mapping, or None."""
+    if not command_id:
+        return None
+    return load_commands().get(command_id)
+
+
 def _context_name_from_first_line(text):
     """Expect first line like # Context Name; return the name."""
-    first = (text.split("\n")[0] or "").strip()
+    first = text.partition("\n")[0].strip()
     if first.startswith("#"):
         return first.lstrip("#").strip()
     return first or "Untitled"
 
 
+# Context file path -> (mtime_ns, size, text); a file is re-read only after it changes on disk.
+_CONTEXT_TEXT_CACHE: Dict[Path, Tuple[int, int, str]] = {}
+# Context file path -> (mtime_ns, size, title); list_contexts only needs the first line.
+_CONTEXT_NAME_CACHE: Dict[Path, Tuple[int, int, str]] = {}
+
+
+def _read_context_text(path: Path) -> Optional[str]:
+    """Return the file's text, served from the cache while its mtime and size are unchanged. None if missing."""
+    try:
+        st = path.stat()
+    except OSError:
+        _CONTEXT_TEXT_CACHE.pop(path, None)
+        return None
+    cached = _CONTEXT_TEXT_CACHE.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    text = read_utf8(path)
+    _CONTEXT_TEXT_CACHE[path] = (st.st_mtime_ns, st.st_size, text)
+    return text
+
+
+def _read_context_name(path: Path, st: os.stat_result) -> str:
+    """Return the context's title from its first line only; uses the full-text cache when it is fresh."""
+    sig = (st.st_mtime_ns, st.st_size)
+    cached = _CONTEXT_TEXT_CACHE.get(path)
+    if cached is not None and cached[:2] == sig:
+        return _context_name_from_first_line(cached[2])
+    named = _CONTEXT_NAME_CACHE.get(path)
+    if named is not None and named[:2] == sig:
+        return named[2]
+    with open(path, "rb") as f:
+        first = f.readline()
+    name = _context_name_from_first_line(first.decode("utf-8", errors="replace").rstrip("\r\n"))
+    _CONTEXT_NAME_CACHE[path] = (sig[0], sig[1], name)
+    return name
+
+
+def invalidate_context(context_id: str) -> None:
+    """Drop cached text for a context after it is written or deleted."""
+    for path in (config.CONTEXTS_DIR / f"{context_id}.md", config.CONTEXTS_DIR / context_id):
+        _CONTEXT_TEXT_CACHE.pop(path, None)
+        _CONTEXT_NAME_CACHE.pop(path, None)
+
+
 def _read_context(context_id):
     """Read context file by id (filename). Return (name, content). Skip if missing."""
-    path = config.CONTEXTS_DIR / f"{context_id}.md"
-    if not path.exists():
-        path = config.CONTEXTS_DIR / context_id
-    if not path.exists():
+    text = _read_context_text(config.CONTEXTS_DIR / f"{context_id}.md")
+    if text is None:
+        text = _read_context_text(config.CONTEXTS_DIR / context_id)
+    if text is None:
         return None
-    text = path.read_text(encoding="utf-8")
     name = _context_name_from_first_line(text)
     return name, text
 
@@ -308,11 +429,19 @@ def _read_context(context_id):
 def list_contexts():
     """Return list of { id, name } for all .md files in contexts dir. Id = filename without .md."""
     out = []
-    for path in config.CONTEXTS_DIR.glob("*.md"):
-        id_ = path.stem
-        text = path.read_text(encoding="utf-8")
-        name = _context_name_from_first_line(text)
-        out.append({"id": id_, "name": name})
+    try:
+        with os.scandir(config.CONTEXTS_DIR) as it:
+            entries = [e for e in it if e.name.endswith(".md")]
+    except OSError:
+        return out
+    for entry in entries:
+        try:
+            if not entry.is_file():
+                continue
+            name = _read_context_name(Path(entry.path), entry.stat())
+        except OSError:
+            continue
+        out.append({"id": entry.name[:-3], "name": name})
     return out
 
 
@@ -320,9 +449,7 @@ def _expand_rag_query_for_retrieval(user_message):
     """For short first-person questions (e.g. 'How tall am I?'), append topic hints so RAG is more likely to retrieve relevant memories (height, weight, etc.)."""
     if not user_message or len(user_message) > 100:
         return user_message
-    lower = user_message.lower()
-    first_person = any(phrase in lower for phrase in (" i ", " my ", " me ", "am i", "do i", "what's my", "what is my"))
-    if not first_person:
+    if not _FIRST_PERSON_RE.search(user_message):
         return user_message
     return (user_message + " height weight physical attributes user facts").strip()
 
@@ -340,7 +467,7 @@ def _build_rules_section(active_rules: Optional[List[Rule]]) -> str:
                 lines.append(_demote_markdown_headings(rule.body))
     # Legacy fallback: if no rules dir content but rules.md exists, append it.
     if (not active_rules or len(active_rules) == 0) and config.RULES_PATH.exists():
-        legacy = config.RULES_PATH.read_text(encoding="utf-8").strip()
+        legacy = read_utf8(config.RULES_PATH).strip()
         if legacy:
             if not lines:
                 lines.append("## Rules")
@@ -402,14 +529,14 @@ def resolve_command(content):
     Command name is alphabetic only. Returns (None, content) if no command or invalid."""
     if not content.strip().startswith("/"):
         return None, content
-    match = re.match(r"^/([a-zA-Z]+)\s*(.*)$", content, re.DOTALL)
+    match = _CMD_ALPHA_RE.match(content)
     if not match:
         return None, content
     name, rest = match.group(1), match.group(2).strip()
     path = config.COMMANDS_DIR / f"{name}.md"
     if not path.exists():
         return None, content  # caller will check and 400 if they want to require command
-    body = path.read_text(encoding="utf-8")
+    body = read_utf8(path)
     return body, rest
 
 
@@ -417,21 +544,21 @@ def get_command_body_if_invoked(content):
     """If content starts with /name, return (name, body) or (None, None). If command file missing, return (name, None)."""
     if not content.strip().startswith("/"):
         return None, None
-    match = re.match(r"^/([a-zA-Z0-9_-]+)\s*(.*)$", content, re.DOTALL)
+    match = _CMD_ID_RE.match(content)
     if not match:
         return None, None
     name = match.group(1)
     path = config.COMMANDS_DIR / f"{name}.md"
     if not path.exists():
         return name, None
-    return name, path.read_text(encoding="utf-8")
+    return name, read_utf8(path)
 
 
 def _extract_rule_ids_from_text(text: str) -> Set[str]:
     """Find @rule-id occurrences; rule-id must be [a-zA-Z0-9_-]+."""
     if not text:
         return set()
-    return set(m.group(1) for m in re.finditer(r"@([a-zA-Z0-9_-]+)", text))
+    return set(_RULE_ID_RE.findall(text))
 
 
 def resolve_active_rules(user_content: str, commands_used: Optional[List[str]] = None) -> List[Rule]:
@@ -444,8 +571,8 @@ def resolve_active_rules(user_content: str, commands_used: Optional[List[str]] =
     rules = load_rules()
     cmds = load_commands()
 
-    # Base: all always_on rules.
-    active_ids: Set[str] = {r.id for r in rules.values() if r.always_on}
+    # Base: all always_on rules (precomputed in load_rules).
+    active_ids: Set[str] = set(_RULES_ALWAYS_ON_IDS)
 
     # Direct from user @mentions.
     active_ids.update(_extract_rule_ids_from_text(user_content))
@@ -455,32 +582,20 @@ def resolve_active_rules(user_content: str, commands_used: Optional[List[str]] =
         cmd = cmds.get(cid)
         if not cmd:
             continue
-        active_ids.update(_extract_rule_ids_from_text(cmd.body))
+        active_ids.update(cmd.rule_refs)
 
     if not active_ids:
-        return [r for r in rules.values() if r.always_on]
-
-    # Build dependency graph: rule A -> rule B when A's body @B.
-    deps: Dict[str, Set[str]] = {}
-    for r in rules.values():
-        referenced = _extract_rule_ids_from_text(r.body)
-        deps[r.id] = referenced
+        return []  # no always_on rules and nothing mentioned
 
+    # Every rule reachable from the active ids through @mentions in rule bodies (cycles are fine).
     resolved_ids: Set[str] = set()
-
-    def _visit(rid: str, visiting: Set[str]) -> None:
-        if rid in resolved_ids or rid in visiting:
-            return
-        visiting.add(rid)
-        for dep_id in deps.get(rid, set()):
-            if dep_id in rules:
-                _visit(dep_id, visiting)
-        visiting.remove(rid)
-        if rid in rules:
-            resolved_ids.add(rid)
-
-    for rid in list(active_ids):
-        _visit(rid, set())
+    stack = [rid for rid in active_ids if rid in rules]
+    while stack:
+        rid = stack.pop()
+        if rid in resolved_ids:
+            continue
+        resolved_ids.add(rid)
+        stack.extend(dep_id for dep_id in _RULES_DEPS.get(rid, ()) if dep_id in rules and dep_id not in resolved_ids)
 
     # Stable sort: always_on rules first, then by name.
     final_rules = [rules[rid] for rid in resolved_ids]
@@ -1,10 +1,59 @@
 """Load prompt templates from the prompts directory (markdown files with placeholders)."""
+import re
+from typing import Dict, Mapping, Tuple
+
 import config
 
+# name -> (mtime_ns, size, text); re-read only when the file changes on disk.
+_PROMPT_CACHE: Dict[str, Tuple[int, int, str]] = {}
+
+_PLACEHOLDER_RE = re.compile(r"\{\{([A-Z_]+)\}\}")
+# name -> (text, parts) where parts alternates literal text and placeholder names (re.split output).
+_TEMPLATE_PARTS_CACHE: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+
+
+def read_utf8(path) -> str:
+    """Read a UTF-8 text file via read_bytes (no buffered text layer); newlines normalized as read_text would."""
+    data = path.read_bytes()
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    return data.decode("utf-8")
+
 
 def load_prompt(name: str) -> str:
     """Load prompt from prompts/<name>.md. Returns empty string if file is missing."""
     path = config.PROMPTS_DIR / f"{name}.md"
-    if not path.exists():
+    try:
+        st = path.stat()
+    except OSError:
+        _PROMPT_CACHE.pop(name, None)
+        return ""
+    cached = _PROMPT_CACHE.get(name)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    text = read_utf8(path).strip()
+    _PROMPT_CACHE[name] = (st.st_mtime_ns, st.st_size, text)
+    return text
+
+
+def render_prompt(name: str, subs: Mapping[str, str]) -> str:
+    """Load prompts/<name>.md and fill its {{PLACEHOLDER}}s from subs. Returns empty string if file is missing.
+
+    The template is split into static segments once per file version; each call only joins.
+    Placeholders not in subs are left as-is.
+    """
+    text = load_prompt(name)
+    if not text:
         return ""
-    return path.read_text(encoding="utf-8").strip()
+    cached = _TEMPLATE_PARTS_CACHE.get(name)
+    if cached is None or cached[0] is not text:
+        cached = (text, tuple(_PLACEHOLDER_RE.split(text)))
+        _TEMPLATE_PARTS_CACHE[name] = cached
+    parts = cached[1]
+    out = [parts[0]]
+    for i in range(1, len(parts), 2):
+        key = parts[i]
+        value = subs.get(key)
+        out.append(value if value is not None else "{{" + key + "}}")
+        out.append(parts[i + 1])
+    return "".join(out)
@@ -1,5 +1,9 @@
 """Chroma vector store for memory. Embed with sentence-transformers; add/query by memory id.
 If ChromaDB fails to import (e.g. Python 3.14), RAG is disabled and memory uses DB fallback only."""
+import threading
+from functools import lru_cache
+from itertools import zip_longest
+
 import config
 
 try:
@@ -15,35 +19,79 @@ except Exception as e:
 _collection = None
 _embed_fn = None
 _model = None
+_MODEL_LOCK = threading.Lock()
+_SYNC_BATCH_SIZE = 256
+# Cached collection.count(); None means unknown (reset on every add/delete).
+_count = None
 
 
 def sync_memories_from_db(app):
     """Ensure Chroma has every memory from the DB (fixes empty/stale RAG after failed adds or old data)."""
+    global _count
     if not _chromadb_available:
         return
     with app.app_context():
         from backend.models import Memory
-        for m in Memory.query.all():
-            try:
-                add_memory(m.id, m.content)
-            except Exception as e:
-                print(f"RAG sync: failed to index memory id={m.id}: {e}")
+        rows = [(m.id, m.content) for m in Memory.query.all()]
+    if not rows:
+        return
+    try:
+        coll = _get_collection()
+        embed = _get_embed_fn()
+    except Exception as e:
+        print(f"RAG sync: index unavailable: {e}")
+        return
+    # One encode + one upsert per batch; a failing batch is retried row by row so one bad row doesn't skip the rest.
+    for start in range(0, len(rows), _SYNC_BATCH_SIZE):
+        batch = rows[start:start + _SYNC_BATCH_SIZE]
+        docs = [content for (_, content) in batch]
+        try:
+            coll.upsert(ids=[str(mid) for (mid, _) in batch], embeddings=embed(docs), documents=docs)
+        except Exception as e:
+            print(f"RAG sync: batch upsert failed ({e}); indexing rows one by one")
+            for mid, content in batch:
+                try:
+                    add_memory(mid, content)
+                except Exception as e:
+                    print(f"RAG sync: failed to index memory id={mid}: {e}")
+    _count = None
 
 
 def _get_embed_fn():
     global _embed_fn, _model
     if _embed_fn is None:
-        from sentence_transformers import SentenceTransformer
-        model = SentenceTransformer(config.RAG_EMBEDDING_MODEL)
-        _model = model
-
-        def _embed(texts):
-            arr = model.encode(texts)
-            return arr.tolist() if hasattr(arr, "tolist") else list(arr)
-        _embed_fn = _embed
+        # Locked so a background preload and a first request don't both load the model.
+        with _MODEL_LOCK:
+            if _embed_fn is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(config.RAG_EMBEDDING_MODEL)
+                _model = model
+
+                def _embed(texts):
+                    arr = model.encode(texts)
+                    return arr.tolist() if hasattr(arr, "tolist") else list(arr)
+                _embed_fn = _embed
     return _embed_fn
 
 
+def preload():
+    """Load the embedding model and open the collection ahead of the first request. Errors are logged only."""
+    try:
+        _get_embed_fn()
+        if _chromadb_available:
+            _get_collection()
+    except Exception as e:
+        print(f"RAG preload failed: {e}")
+
+
+def embed_normalized(texts):
+    """Embed texts as a float32 numpy matrix with unit-length rows, so cosine similarity is a plain dot product."""
+    import numpy as np
+    _get_embed_fn()
+    vecs = _model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+    return vecs.astype(np.float32, copy=False)
+
+
 def _get_model():
     """Return the loaded SentenceTransformer model (for tokenizer / max_seq_length). Loads model if needed."""
     _get_embed_fn()
@@ -80,6 +128,7 @@ def chunk_text_for_embedding(text, max_tokens=None):
 
 def clear_memory_collection():
     """Remove all vectors from the Chroma memory collection. Used by the re-embed script after switching models."""
+    global _count
     if not _chromadb_available:
         return
     coll = _get_collection()
@@ -87,6 +136,8 @@ def clear_memory_collection():
     ids = res.get("ids") or []
     if ids:
         coll.delete(ids=ids)
+    _count = None
+    _embed_query_cached.cache_clear()
 
 
 def _get_collection():
@@ -101,36 +152,61 @@ def _get_collection():
     return _collection
 
 
+def index_size():
+    """Number of memories in the Chroma collection (0 when RAG is disabled). Cached until the next add/delete."""
+    global _count
+    if not _chromadb_available:
+        return 0
+    if _count is None:
+        _count = _get_collection().count()
+    return _count
+
+
 def add_memory(memory_id, content):
     """Embed content and add to Chroma with id=str(memory_id)."""
+    global _count
     if not _chromadb_available:
         return
     coll = _get_collection()
     embed = _get_embed_fn()
     vec = embed([content])
     coll.upsert(ids=[str(memory_id)], embeddings=vec, documents=[content])
+    _count = None
 
 
 def delete_memory(memory_id):
+    global _count
     if not _chromadb_available:
         return
     try:
         _get_collection().delete(ids=[str(memory_id)])
     except Exception:
         pass
+    _count = None
 
 
 def query(query_text, top_k=5, min_similarity=None):
     """Return list of (memory_id, content) from Chroma. Only includes memories with similarity >= min_similarity (0–1).
     Uses config.RAG_SIMILARITY_THRESHOLD if min_similarity is None. Chroma returns cosine distance; we use similarity = 1 - distance."""
+    if not _chromadb_available:
+        return []
+    return query_by_embedding(_embed_query_cached(query_text), top_k=top_k, min_similarity=min_similarity)
+
+
+@lru_cache(maxsize=256)
+def _embed_query_cached(text):
+    """Query embedding as a tuple; repeated (and RAG-expanded) queries skip the model forward pass."""
+    return tuple(_get_embed_fn()([text])[0])
+
+
+def query_by_embedding(vec, top_k=5, min_similarity=None):
+    """Like query(), for a caller that already embedded the text (e.g. to reuse one vector for several checks)."""
     if not _chromadb_available:
         return []
     threshold = min_similarity if min_similarity is not None else config.RAG_SIMILARITY_THRESHOLD
     coll = _get_collection()
-    embed = _get_embed_fn()
-    vec = embed([query_text])
     res = coll.query(
-        query_embeddings=vec,
+        query_embeddings=[vec.tolist() if hasattr(vec, "tolist") else list(vec)],
         n_results=min(top_k, 20),
         include=["documents", "distances"],
     )
@@ -139,13 +215,12 @@ def query(query_text, top_k=5, min_similarity=None):
     ids_list = res["ids"][0]
     docs_list = (res.get("documents") or [[]])[0]
     dists_list = (res.get("distances") or [[]])[0]
+    # Chroma returns parallel lists; a missing document reads as "", a missing distance keeps the row.
     out = []
-    for i, id_ in enumerate(ids_list):
-        doc = (docs_list[i] if i < len(docs_list) else "") or ""
-        if i < len(dists_list):
-            dist = dists_list[i]
-            similarity = max(0.0, 1.0 - dist)
-            if similarity < threshold:
-                continue
-        out.append((id_, doc))
+    for id_, doc, dist in zip_longest(ids_list, docs_list, dists_list):
+        if id_ is None:
+            break
+        if dist is not None and max(0.0, 1.0 - dist) < threshold:
+            continue
+        out.append((id_, doc or ""))
     return out
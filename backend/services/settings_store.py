@@ -1,8 +1,12 @@
 """User settings: API keys and default model. Stored in data/settings.json.
 Env vars (.env) take precedence for API keys if set; settings file overrides when env is empty."""
-import json
+import copy
+import os
+import threading
 from pathlib import Path
 
+import orjson
+
 import config
 from backend.services.web_search_mode import (
     WEB_SEARCH_MODE_OFF,
@@ -11,48 +15,76 @@ from backend.services.web_search_mode import (
 
 SETTINGS_PATH = config.DATA_DIR / "settings.json"
 
-_PROVIDER_ENV_KEYS = {
-    "openai": "OPENAI_API_KEY",
-    "anthropic": "ANTHROPIC_API_KEY",
-    "google": "GOOGLE_API_KEY",
-    "tavily": "TAVILY_API_KEY",
+# provider -> (primary env var, fallback env var or None)
+_PROVIDER_ENV = {
+    "openai": ("OPENAI_API_KEY", None),
+    "anthropic": ("ANTHROPIC_API_KEY", None),
+    "google": ("GOOGLE_API_KEY", "GEMINI_API_KEY"),
+    "tavily": ("TAVILY_API_KEY", None),
 }
+_PROVIDERS = tuple(_PROVIDER_ENV)
+_PROVIDERS_SET = frozenset(_PROVIDERS)
 
-_PROVIDER_ENV_FALLBACK = {
-    "google": "GEMINI_API_KEY",
-}
+# Parsed settings.json keyed by (mtime_ns, size); re-read only when the file changes.
+_cache = {"stat": None, "data": {}}
+_cache_lock = threading.Lock()
+# Serializes read-modify-write in update_settings so concurrent saves don't drop each other's keys.
+_update_lock = threading.Lock()
 
 
 def _load_raw():
-    """Load settings dict from file. Returns {} if missing."""
-    if not SETTINGS_PATH.exists():
+    """Load settings dict from file. Returns {} if missing.
+    The dict is cached until the file changes and is shared; copy before mutating."""
+    try:
+        st = SETTINGS_PATH.stat()
+    except OSError:
         return {}
+    key = (st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        if _cache["stat"] == key:
+            return _cache["data"]
     try:
-        data = json.loads(SETTINGS_PATH.read_text(encoding="utf-8"))
-        return data if isinstance(data, dict) else {}
-    except (json.JSONDecodeError, OSError):
+        data = orjson.loads(SETTINGS_PATH.read_bytes())
+        data = data if isinstance(data, dict) else {}
+    except (orjson.JSONDecodeError, OSError):
         return {}
+    with _cache_lock:
+        _cache.update(stat=key, data=data)
+    return data
 
 
 def _save_raw(data):
     """Write settings dict to file."""
     config.ensure_data_dirs()
-    SETTINGS_PATH.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    # Write a temp file and rename it over settings.json so readers never see a torn file.
+    tmp = SETTINGS_PATH.with_suffix(".json.tmp")
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, SETTINGS_PATH)
+    # Seed the cache with what was just written so the next read is a hit.
+    st = SETTINGS_PATH.stat()
+    with _cache_lock:
+        _cache.update(stat=(st.st_mtime_ns, st.st_size), data=data)
 
 
 def get_api_key(provider):
     """Return effective API key for provider. Checks env first, then settings file."""
-    import os
-    env_key = _PROVIDER_ENV_KEYS.get(provider)
-    fallback_key = _PROVIDER_ENV_FALLBACK.get(provider)
+    return _get_api_key_from(None, provider)
+
+
+def _get_api_key_from(data, provider):
+    """get_api_key() against an already-loaded settings dict (None = load on demand, only if env has no key)."""
+    env_key, fallback_key = _PROVIDER_ENV.get(provider, (None, None))
     # Env takes precedence
-    val = os.environ.get(env_key, "") if env_key else ""
-    if not val and fallback_key:
-        val = os.environ.get(fallback_key, "") or ""
-    if val and val.strip():
-        return val.strip()
+    env = os.environ
+    val = ((env.get(env_key) if env_key else None) or (env.get(fallback_key) if fallback_key else None) or "").strip()
+    if val:
+        return val
     # Fall back to settings file
-    data = _load_raw()
+    if data is None:
+        data = _load_raw()
     keys = data.get("api_keys") or {}
     return (keys.get(provider) or "").strip()
 
@@ -66,22 +98,26 @@ def mask_key(key):
 
 def get_settings_for_api():
     """Return settings safe for API response: masked API key status. default_model comes from models.yaml via API layer."""
+    data = _load_raw()
     effective = {}
-    for p in ("openai", "anthropic", "google", "tavily"):
-        k = get_api_key(p)
+    for p in _PROVIDERS:
+        k = _get_api_key_from(data, p)
         effective[p] = {
             "set": bool(k),
             "masked": mask_key(k),
         }
     return {
         "api_keys": effective,
-        "default_web_search_mode": get_default_web_search_mode(),
+        "default_web_search_mode": _default_web_search_mode_from(data),
     }
 
 
 def get_default_web_search_mode():
     """Return persisted default web search mode for new chats."""
-    data = _load_raw()
+    return _default_web_search_mode_from(_load_raw())
+
+
+def _default_web_search_mode_from(data):
     return normalize_web_search_mode(
         data.get("default_web_search_mode"),
         default=WEB_SEARCH_MODE_OFF,
@@ -90,13 +126,18 @@ def get_default_web_search_mode():
 
 def update_settings(updates):
     """Update settings. updates: { api_keys? }. default_model is managed in models.yaml via API layer."""
-    data = _load_raw()
+    with _update_lock:
+        _update_settings_locked(updates)
+
+
+def _update_settings_locked(updates):
+    data = copy.deepcopy(_load_raw())
     if "api_keys" in updates:
         new_keys = updates["api_keys"]
         if isinstance(new_keys, dict):
             current = data.get("api_keys") or {}
             for k, v in new_keys.items():
-                if k in ("openai", "anthropic", "google", "tavily") and v is not None:
+                if k in _PROVIDERS_SET and v is not None:
                     v = str(v).strip()
                     if v:
                         current[k] = v
@@ -128,6 +169,11 @@ def invalidate_provider_clients():
         google_provider._client = None  # noqa
     except Exception:
         pass
+    try:
+        from backend.services import web_search
+        web_search._client_cache.clear()  # noqa
+    except Exception:
+        pass
     try:
         from backend.services import models_config
         models_config.invalidate_models_cache()
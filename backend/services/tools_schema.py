@@ -12,47 +12,54 @@ WEB_SEARCH_TOOL = {
     },
 }
 
+# Adapter outputs are built once at import; the *_tools() functions return these shared lists (do not mutate).
+_OPENAI_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": WEB_SEARCH_TOOL["name"],
+            "description": WEB_SEARCH_TOOL["description"],
+            "parameters": WEB_SEARCH_TOOL["parameters"],
+        },
+    }
+]
+
+_ANTHROPIC_TOOLS = [
+    {
+        "name": WEB_SEARCH_TOOL["name"],
+        "description": WEB_SEARCH_TOOL["description"],
+        "input_schema": WEB_SEARCH_TOOL["parameters"],
+    }
+]
+
+_GEMINI_TOOLS = [
+    {
+        "name": WEB_SEARCH_TOOL["name"],
+        "description": WEB_SEARCH_TOOL["description"],
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "The search query to execute.",
+                },
+            },
+            "required": ["query"],
+        },
+    }
+]
+
 
 def openai_tools():
     """OpenAI format: list of tool specs with function schema."""
-    return [
-        {
-            "type": "function",
-            "function": {
-                "name": WEB_SEARCH_TOOL["name"],
-                "description": WEB_SEARCH_TOOL["description"],
-                "parameters": WEB_SEARCH_TOOL["parameters"],
-            },
-        }
-    ]
+    return _OPENAI_TOOLS
 
 
 def anthropic_tools():
     """Anthropic format: list of tool definitions."""
-    return [
-        {
-            "name": WEB_SEARCH_TOOL["name"],
-            "description": WEB_SEARCH_TOOL["description"],
-            "input_schema": WEB_SEARCH_TOOL["parameters"],
-        }
-    ]
+    return _ANTHROPIC_TOOLS
 
 
 def gemini_tools():
     """Gemini (Google) format: function declarations."""
-    return [
-        {
-            "name": WEB_SEARCH_TOOL["name"],
-            "description": WEB_SEARCH_TOOL["description"],
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "The search query to execute.",
-                    },
-                },
-                "required": ["query"],
-            },
-        }
-    ]
+    return _GEMINI_TOOLS
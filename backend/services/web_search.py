@@ -1,33 +1,80 @@
 """Web search via Tavily API. Cache by query similarity, retries on failure."""
 import difflib
-import re
+import random
+import threading
 import time
+from collections import OrderedDict
 from typing import Any
 
 import config
 from backend.services.settings_store import get_api_key
 
+try:
+    from tavily import TavilyClient
+except ImportError:
+    TavilyClient = None
+
+try:
+    from tavily.errors import (
+        BadRequestError,
+        ForbiddenError,
+        InvalidAPIKeyError,
+        MissingAPIKeyError,
+        UsageLimitExceededError,
+    )
+    # Errors that will fail the same way on retry (bad key, bad request, quota exhausted).
+    _NON_RETRYABLE_ERRORS: tuple[type[BaseException], ...] = (
+        BadRequestError,
+        ForbiddenError,
+        InvalidAPIKeyError,
+        MissingAPIKeyError,
+        UsageLimitExceededError,
+    )
+except ImportError:
+    _NON_RETRYABLE_ERRORS = ()
+
 # ~1k tokens ≈ 4000 chars
 MAX_CONTENT_CHARS = 4000
+_SNIPPET_CHARS = 500
 
-_cache: dict[str, list[dict[str, Any]]] = {}
+# normalized query -> (stored_at monotonic, results); least recently used first.
+_cache: "OrderedDict[str, tuple[float, list[dict[str, Any]]]]" = OrderedDict()
+_cache_lock = threading.Lock()
 _CACHE_SIMILARITY_THRESHOLD = 0.85
+_CACHE_MAX_ENTRIES = 256
+_CACHE_TTL_SECONDS = 3600
+# API key -> TavilyClient; built once per key instead of per search.
+_client_cache: dict[str, Any] = {}
+_MAX_ATTEMPTS = 3
+_RETRY_BASE_SECONDS = 0.5
+_RETRY_CAP_SECONDS = 2.0
 
 
 def _normalize_query(q: str) -> str:
-    q = (q or "").strip().lower()
-    q = re.sub(r"\s+", " ", q)
-    return q
+    # str.split() with no argument collapses whitespace runs and trims the ends in C.
+    return " ".join((q or "").lower().split())
 
 
-def _find_similar_cached_query(query: str) -> str | None:
-    """Return cache key if a similar query exists, else None."""
-    nq = _normalize_query(query)
+def _find_similar_cached_query(nq: str) -> str | None:
+    """Return cache key if a query similar to nq (already normalized) exists, else None. Caller holds _cache_lock."""
     if not nq:
         return None
+    now = time.monotonic()
+    expired = [k for k, (stored_at, _) in _cache.items() if now - stored_at > _CACHE_TTL_SECONDS]
+    for k in expired:
+        del _cache[k]
+    if nq in _cache:
+        return nq
+    # real_quick_ratio/quick_ratio are cheap upper bounds on ratio(), so most keys are rejected
+    # without the full Ratcliff/Obershelp match; the accepted set is unchanged.
+    matcher = difflib.SequenceMatcher(None, nq, "")
     for key in _cache:
-        ratio = difflib.SequenceMatcher(None, nq, key).ratio()
-        if ratio >= _CACHE_SIMILARITY_THRESHOLD:
+        matcher.set_seq2(key)
+        if matcher.real_quick_ratio() < _CACHE_SIMILARITY_THRESHOLD:
+            continue
+        if matcher.quick_ratio() < _CACHE_SIMILARITY_THRESHOLD:
+            continue
+        if matcher.ratio() >= _CACHE_SIMILARITY_THRESHOLD:
             return key
     return None
 
@@ -35,10 +82,21 @@ def _find_similar_cached_query(query: str) -> str | None:
 def _truncate_content(text: str | None) -> str:
     if not text:
         return ""
-    text = (text or "").strip()
+    text = text.strip()
     if len(text) <= MAX_CONTENT_CHARS:
         return text
-    return text[: MAX_CONTENT_CHARS].rsplit(maxsplit=1)[0] + "…"
+    return text[:MAX_CONTENT_CHARS].rsplit(maxsplit=1)[0] + "…"
+
+
+def _is_retryable(e: Exception) -> bool:
+    """False for errors that a retry cannot fix: auth/quota/bad request, or HTTP 4xx other than 429."""
+    if _NON_RETRYABLE_ERRORS and isinstance(e, _NON_RETRYABLE_ERRORS):
+        return False
+    response = getattr(e, "response", None)
+    status = getattr(e, "status_code", None) or getattr(response, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+        return False
+    return True
 
 
 def _search_tavily_once(query: str) -> list[dict[str, Any]]:
@@ -46,11 +104,11 @@ def _search_tavily_once(query: str) -> list[dict[str, Any]]:
     key = (config.TAVILY_API_KEY or "").strip() or get_api_key("tavily")
     if not key:
         return []
-    try:
-        from tavily import TavilyClient
-    except ImportError:
+    if TavilyClient is None:
         return []
-    client = TavilyClient(api_key=key)
+    client = _client_cache.get(key)
+    if client is None:
+        client = _client_cache.setdefault(key, TavilyClient(api_key=key))
     max_results = getattr(config, "TAVILY_MAX_RESULTS", 5)
     response = client.search(query=query, max_results=max_results)
     raw = response.get("results", []) if isinstance(response, dict) else getattr(response, "results", [])
@@ -65,7 +123,8 @@ def _search_tavily_once(query: str) -> list[dict[str, Any]]:
             url = getattr(item, "url", "") or ""
             content = getattr(item, "content", None) or getattr(item, "snippet", "") or ""
         content = _truncate_content(content)
-        snippet = (content[:500] + "…") if len(content) > 500 else content
+        # Short content is shared as the snippet (same object); long content only copies the 500-char head.
+        snippet = content if len(content) <= _SNIPPET_CHARS else content[:_SNIPPET_CHARS] + "…"
         results.append({
             "title": title,
             "url": url,
@@ -85,22 +144,31 @@ def search(query: str) -> list[dict[str, Any]]:
     if not query:
         return []
 
+    nq = _normalize_query(query)
     # Check cache for similar query
-    similar_key = _find_similar_cached_query(query)
-    if similar_key is not None:
-        return _cache[similar_key]
+    with _cache_lock:
+        similar_key = _find_similar_cached_query(nq)
+        if similar_key is not None:
+            _cache.move_to_end(similar_key)
+            return _cache[similar_key][1]
 
-    last_error = None
-    for attempt in range(3):
+    for attempt in range(_MAX_ATTEMPTS):
         try:
             results = _search_tavily_once(query)
             if results is not None:
-                key = _normalize_query(query)
-                _cache[key] = results
+                with _cache_lock:
+                    _cache[nq] = (time.monotonic(), results)
+                    _cache.move_to_end(nq)
+                    while len(_cache) > _CACHE_MAX_ENTRIES:
+                        _cache.popitem(last=False)
                 return results
         except Exception as e:
-            last_error = e
-            if attempt < 2:
-                time.sleep(1.0 + attempt * 0.5)
+            if not _is_retryable(e):
+                print(f"Web search failed (not retrying): {e}")
+                return []
+            if attempt < _MAX_ATTEMPTS - 1:
+                # Exponential backoff with jitter so concurrent failures don't retry in lockstep.
+                delay = min(_RETRY_CAP_SECONDS, _RETRY_BASE_SECONDS * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.5))
     # After retries, return empty so the flow continues without web context
     return []
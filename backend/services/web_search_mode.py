@@ -9,16 +9,20 @@ WEB_SEARCH_MODES = (
     WEB_SEARCH_MODE_NATIVE,
     WEB_SEARCH_MODE_TAVILY,
 )
+# Maps a parsed mode to the module constant itself, so results compare against constants by identity first.
+_CANONICAL_MODES = {mode: mode for mode in WEB_SEARCH_MODES}
 
 
 def parse_web_search_mode(value):
     """Return normalized mode string or None if invalid."""
     if value is None:
         return None
-    mode = str(value).strip().lower()
-    if mode in WEB_SEARCH_MODES:
-        return mode
-    return None
+    # Stored modes are almost always canonical already; skip the str/strip/lower copies.
+    if type(value) is str:
+        canonical = _CANONICAL_MODES.get(value)
+        if canonical is not None:
+            return canonical
+    return _CANONICAL_MODES.get(str(value).strip().lower())
 
 
 def normalize_web_search_mode(value, default=WEB_SEARCH_MODE_OFF):
@@ -83,8 +87,11 @@ def resolve_command_web_search_mode(command, chat_mode=WEB_SEARCH_MODE_OFF):
     - otherwise off
     """
     explicit = parse_web_search_mode(getattr(command, "web_search_mode", None))
-    if explicit is not None and is_command_web_search_mode_explicit(command):
-        return explicit
+    if explicit is not None:
+        # Same as is_command_web_search_mode_explicit, without re-reading and re-parsing web_search_mode.
+        explicit_flag = getattr(command, "web_search_mode_explicit", None)
+        if explicit_flag is None or explicit_flag:
+            return explicit
     if bool(getattr(command, "web_search_enabled", False)):
         return normalize_web_search_mode(chat_mode, default=WEB_SEARCH_MODE_OFF)
     return WEB_SEARCH_MODE_OFF
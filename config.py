@@ -14,12 +14,19 @@ DATA_DIR = Path(os.environ.get("DATA_DIR", os.path.join(_DATA_ROOT, "data")))
 # Built-in prompts (markdown files with placeholders); overrides live in data/
 PROMPTS_DIR = _DATA_ROOT / "prompts"
 
+_dirs_ready = False
+
+
 def ensure_data_dirs():
-    """Create data dir and subdirs if missing."""
+    """Create data dir and subdirs if missing. Only the first call touches the filesystem."""
+    global _dirs_ready
+    if _dirs_ready:
+        return
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     (DATA_DIR / "contexts").mkdir(parents=True, exist_ok=True)
     (DATA_DIR / "commands").mkdir(parents=True, exist_ok=True)
     (DATA_DIR / "rules").mkdir(parents=True, exist_ok=True)
+    _dirs_ready = True
 
 # Paths
 CONTEXTS_DIR = DATA_DIR / "contexts"
@@ -28,6 +35,8 @@ RULES_DIR = DATA_DIR / "rules"
 RULES_PATH = DATA_DIR / "rules.md"
 DB_PATH = DATA_DIR / "app.db"
 CHROMA_DIR = DATA_DIR / "chroma"
+# Cached context-file embeddings for memory dedupe (rebuilt automatically when contexts or the model change)
+CONTEXT_EMBEDDINGS_PATH = DATA_DIR / "context_embeddings.npz"
 
 # User name for base system prompt (optional; from env)
 USER_NAME = os.environ.get("USER_NAME", "").strip()
@@ -41,12 +50,27 @@ TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY", "")
 # Web search (Tavily)
 TAVILY_MAX_RESULTS = int(os.environ.get("TAVILY_MAX_RESULTS", "5"))
 
+# SSE streaming: provider chunks are coalesced into one event until this many characters
+# are pending or this many milliseconds have passed since the last event.
+SSE_COALESCE_CHARS = int(os.environ.get("SSE_COALESCE_CHARS", "256"))
+SSE_COALESCE_MS = float(os.environ.get("SSE_COALESCE_MS", "20"))
+# Max seconds the stream waits for the generated chat title before using the fallback title.
+TITLE_TIMEOUT_SECONDS = float(os.environ.get("TITLE_TIMEOUT_SECONDS", "10"))
+
+# Command evaluation: max concurrent evaluator LLM calls.
+EVAL_POOL_SIZE = int(os.environ.get("EVAL_POOL_SIZE", "8"))
+# Reuse the verdict for an identical evaluation prompt instead of asking the model again (opt-in: set 1 to enable).
+EVAL_CACHE = os.environ.get("EVAL_CACHE", "0").strip().lower() in ("1", "true", "yes")
+
 # RAG: embedding model for memory indexing and retrieval (sentence-transformers model name).
 RAG_EMBEDDING_MODEL = os.environ.get("RAG_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
 
 # RAG: only include memories with similarity >= this (0–1). Chroma uses cosine distance; we use similarity = 1 - distance.
 RAG_SIMILARITY_THRESHOLD = float(os.environ.get("RAG_SIMILARITY_THRESHOLD", "0.5"))
 
+# Memory extraction: skip the extractor LLM call for turns that cannot hold a personal fact (set 0 to disable).
+MEMORY_PREFILTER = os.environ.get("MEMORY_PREFILTER", "1").strip().lower() not in ("0", "false", "no")
+
 # File attachments (file-based prompting)
 MAX_ATTACHMENT_SIZE_BYTES = int(os.environ.get("MAX_ATTACHMENT_SIZE_BYTES", str(10 * 1024 * 1024)))  # 10 MB
 MAX_ATTACHMENTS_PER_MESSAGE = int(os.environ.get("MAX_ATTACHMENTS_PER_MESSAGE", "3"))
@@ -219,6 +219,7 @@ export async function addMessageStream(
     onStarted,
     onChunk,
     onDone,
+    onTitle,
     onStatus,
     onCancel,
     attachments: attachmentFiles = [],
@@ -292,6 +293,7 @@ export async function addMessageStream(
             onChunk(obj.c);
           }
           if (obj.t === "done") onDone(fullContent, obj);
+          if (obj.t === "title" && obj.title) onTitle?.(obj.title);
           if (obj.t === "error") throw new Error(obj.error);
         } catch (e) {
           if (e instanceof SyntaxError) continue;
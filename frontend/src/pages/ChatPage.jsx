@@ -960,6 +960,10 @@ export default function ChatPage() {
             signal: controller.signal,
             onChunk: (c) => setStreamingContent((prev) => prev + c),
             onStatus: (msg) => setStreamingStatus(msg),
+            onTitle: (title) => {
+              setChats((prev) => prev.map((c) => (c.id === chatIdForStream ? { ...c, title } : c)));
+              setCurrentChat((prev) => (prev && prev.id === chatIdForStream ? { ...prev, title } : prev));
+            },
             onCancel: () => {
               setMessages((prev) => prev.filter((m) => m.id !== "temp-assistant"));
               setStreamingContent("");
@@ -1034,6 +1038,10 @@ export default function ChatPage() {
       signal: controller.signal,
       onChunk: (c) => setStreamingContent((prev) => prev + c),
       onStatus: (msg) => setStreamingStatus(msg),
+      onTitle: (title) => {
+        setChats((prev) => prev.map((c) => (c.id === chatIdForStream ? { ...c, title } : c)));
+        setCurrentChat((prev) => (prev && prev.id === chatIdForStream ? { ...prev, title } : prev));
+      },
       onCancel: () => {
         setMessages((prev) => prev.filter((m) => m.id !== "temp-assistant"));
         setStreamingContent("");